@@ -1,12 +1,17 @@
 from pathlib import Path
-import re
-import requests
-import shutil
-from reportlab.pdfgen.canvas import Canvas
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from reportlab.lib.units import cm
-from PIL import Image as PILImage
+# NB the reportlab Canvas and PIL are imported where used, so loading a
+# race doesn't pull them in
 
 from .constants import LOG, DATA_DIR
+from . import session, blobs
+from .cache_policy import is_stale
+from .derivatives import get_derivative
+# these used to live here
+from .img_urls import tag_stage_imgs, split_img_url
 from .drawing.Rect import Rect
 
 """
@@ -23,9 +28,22 @@ in memory as  : dict with url and data parsed from it, plus fp
 
 class Image:
 
-    def __init__(self, url, dpath, tag=None, fname=None):
+    def __init__(self, url, dpath, tag=None, fname=None, race_start=None,
+                 index=None):
         """
-        Hold url and fp for an image, downloading if not already at fp
+        Hold url and fp for an image.
+
+        Lazy: nothing is downloaded until the file is actually needed, ie
+        on first access of fpath or width_height.  At that point it is
+        downloaded if not already at fp (or if gone stale under the 'image'
+        policy in cache_policy.py, when the race_start is passed).
+        Use target for the path without triggering a download, and
+        download_images() to fetch a batch up front.  Either way it is
+        only tried once (a dead url would otherwise be tried on every
+        access) - call fetch() to try again.
+
+        Pass the race's ImageIndex (see img_index.py) so the dimensions
+        etc are recorded at download, and read from there after
 
         used to parse url and assign a type etc but probably better done
         when consuming
@@ -33,56 +51,220 @@ class Image:
 
         self.url = url
         self.tag = tag
-        self.fpath = None
+        self.target = None
+        self._race_start = race_start
+        self._index = index
+        self._fetched = False
+        # whether fetch() has been tried, whatever the result
+        self._tried = False
 
         if url is not None:
             if fname is None:
-                self.fpath = dpath / self.url.split('/')[-1]
+                self.target = dpath / self.url.split('/')[-1]
             else:
                 f_ext = url.split('.')[-1]
-                self.fpath = dpath / f"{fname}.{f_ext}"
-
-            if not self.fpath.exists():
-                self.download(fname)
+                self.target = dpath / f"{fname}.{f_ext}"
 
         self._width_height = None
 
+    @property
+    def fpath(self):
+        """
+        The path to the image file, downloading it first if need be
+        """
+        if not self._tried and self.url is not None:
+            self.fetch()
+
+        return self.target
+
     @property
     def width_height(self):
         if self._width_height is None:
-            i_dict = PILImage.open(self.fpath)
-            self._width_height = i_dict.width, i_dict.height
+            if self._index is not None:
+                self._width_height = self._index.width_height(self.fpath)
+            else:
+                from PIL import Image as PILImage
+                with PILImage.open(self.fpath) as i_dict:
+                    self._width_height = i_dict.width, i_dict.height
         return self._width_height
 
-    def download(self, fname=None):
+    @property
+    def content_hash(self):
+        if self._index is not None:
+            return self._index.content_hash(self.fpath)
+        return blobs.file_hash(self.fpath)
+
+    def is_stale(self, race_start=None):
+        if race_start is None or not self.target.exists():
+            return False
+
+        fetched = datetime.fromtimestamp(self.target.stat().st_mtime)
+
+        return is_stale(fetched, 'image', race_start)
+
+    @property
+    def needs_download(self):
+        if self.url is None or self._tried:
+            return False
+
+        return (not self.target.exists()
+                or self.is_stale(self._race_start))
+
+    def fetch(self, save_index=True, force=False):
         """
-        Try the url
+        Download if missing or stale (or force=True), and index it
+        Returns True if the image is now on disk
         """
+        self._tried = True
+
+        if force:
+            ok = self.download(force=True)
+        elif not self.target.exists():
+            ok = self.download()
+        elif self.is_stale(self._race_start):
+            ok = self.download(force=True)
+        else:
+            return True
 
-        req = requests.get(self.url, stream=True)
+        if ok and self._index is not None:
+            self._index.add(self.target, save=save_index)
 
-        if not req.ok:
-            LOG.info(f"cannot download image from {self.url}")
-            return
+        self._fetched = ok
 
-        LOG.info(f"got image from {self.url}")
-        with open(self.fpath, 'wb') as fp:
-            shutil.copyfileobj(req.raw, fp)
+        return ok
 
-        del req
+    def download(self, force=False):
+        """
+        Try the blob store (see blobs.py), then the url.
+        Pass force=True to go to the url anyway
+
+        Streams to a temp file, which is only moved into place once it
+        opens as a valid image - so an interrupted download leaves nothing
+        behind.  Returns True if the image is now on disk
+        """
+        blob = None if force else blobs.lookup(self.url)
+
+        if blob is None:
+            try:
+                req = session.get(self.url, stream=True)
+            except Exception as e:
+                LOG.info(f"cannot download image from {self.url}: {e}")
+                return False
+
+            if not req.ok:
+                LOG.info(f"cannot download image from {self.url}")
+                req.close()
+                return False
+
+            tmp = blobs.temp_fpath()
+            try:
+                with open(tmp, 'wb') as fp:
+                    for chunk in req.iter_content(chunk_size=1 << 16):
+                        fp.write(chunk)
+            except Exception as e:
+                LOG.info(f"download of {self.url} failed: {e}")
+                tmp.unlink(missing_ok=True)
+                return False
+            finally:
+                # hand the connection back to the pool
+                req.close()
+
+            if not is_valid_img(tmp):
+                LOG.info(f"not a valid image from {self.url}")
+                tmp.unlink()
+                return False
+
+            LOG.info(f"got image from {self.url}")
+            blob = blobs.add(tmp, self.url, f_ext=self.target.suffix[1:])
+
+        blobs.link(blob, self.target)
+
+        return True
+
+    def __setstate__(self, state):
+        # from a snapshot, so a failed download is tried again this run
+        self.__dict__.update(state)
+        self._tried = self._fetched
 
     def __repr__(self):
         return f"Image('{self.url.split("/")[-1]}'', tag={self.tag}')"
 
 
+def is_valid_img(fpath):
+    """
+    Does the file open as an image, with all its data there?
+    """
+    from PIL import Image as PILImage
+
+    try:
+        with PILImage.open(fpath) as img:
+            img.verify()
+        # verify() doesn't decode, so load too for truncated files
+        with PILImage.open(fpath) as img:
+            img.load()
+    except Exception:
+        return False
+
+    return True
+
+
+def download_images(imgs, max_workers=8, pool=None):
+    """
+    Download any of the passed Image objects that need it, concurrently,
+    within the per host limits shared with all other fetching.
+    Pass a ThreadPoolExecutor as pool to run on that rather than a new one.
+    Logs and returns the timings, as a list of dicts
+    """
+    todo = {img.target: img for img in imgs
+            if img is not None and img.needs_download}.values()
+
+    def timed_fetch(img):
+        with session.host_slot(img.url):
+            start = time.perf_counter()
+            ok = img.fetch(save_index=False)
+            secs = time.perf_counter() - start
+        LOG.info(f"{img.target.name}: {'ok' if ok else 'FAILED'} "
+                 f"in {secs:.2f}s")
+        return {'fpath': img.target, 'url': img.url, 'ok': ok, 'secs': secs}
+
+    start = time.perf_counter()
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            out = list(pool.map(timed_fetch, todo))
+    else:
+        out = list(pool.map(timed_fetch, todo))
+
+    indexes = {id(img._index): img._index for img in todo
+               if img._index is not None}
+    for index in indexes.values():
+        index.save()
+
+    if out:
+        failed = len([x for x in out if not x['ok']])
+        print(f"downloaded {len(out) - failed} images in "
+              f"{time.perf_counter() - start:.1f}s, {failed} failed")
+
+    return out
+
+
 def draw_img(img_fp, rect, canvas=None, fp_out=None,
              trim_bottom_cm=None,
              km_to_go=False, profile_margins=None, stage_km=None,
-             add_calibration=False, cal_lims=None):
+             add_calibration=False, cal_lims=None, derive=True):
     """
     Draws the img, fitting to within the passed max coords
     Returns the dimensions actually drawn, in a rect
+
+    Pass an Image rather than a path to take the dimensions from
+    its index rather than opening the file
+
+    By default draws a copy downsampled for the space (see derivatives.py),
+    as an XObject so it is only embedded once per pdf however often drawn.
+    Pass derive=False to draw the original
     """
+    from reportlab.pdfgen.canvas import Canvas
+    from PIL import Image as PILImage
+
     if canvas is None:
         can = Canvas(fp_out.as_posix())
     else:
@@ -91,10 +273,16 @@ def draw_img(img_fp, rect, canvas=None, fp_out=None,
     # make scaled versions
     # take in image -> h, w and rect to draw in h, w
     # create a 3rd rect to actually draw
-    i_dict = PILImage.open(img_fp)
+    content_hash = None
+    if isinstance(img_fp, Image):
+        img_w, img_h = img_fp.width_height
+        content_hash = img_fp.content_hash
+        img_fp = img_fp.fpath
+    else:
+        with PILImage.open(img_fp) as i_dict:
+            img_w, img_h = i_dict.width, i_dict.height
     # print('image in - h:', img_h, 'w:', img_w, 'shape:', img_h/img_w)
-    s_h, s_w = scale_image(
-        i_dict.height, i_dict.width, rect.height, rect.width)
+    s_h, s_w = scale_image(img_h, img_w, rect.height, rect.width)
     # print('scaled -> w:', s_w, 'h:', s_h)
 
     actual = Rect(left=rect.left, top=rect.top, height=s_h, width=s_w)
@@ -115,7 +303,11 @@ def draw_img(img_fp, rect, canvas=None, fp_out=None,
         actual.left = actual.right - s_w
 
     # actually draw it
-    can.drawInlineImage(
+    if derive:
+        img_fp = get_derivative(img_fp, actual.width, actual.height,
+                                content_hash=content_hash)
+
+    can.drawImage(
         img_fp.as_posix(),
         x=actual.left * cm,
         y=actual.bottom * cm,
@@ -330,6 +522,7 @@ TEST_IMG_FP = Path('~/shared/my_packages/roady/data/dauphine_2025/',
 
 def test_draw(rect, img_fp=TEST_IMG_FP,
               fp_out=DATA_DIR / 'testing' / 'draw_img.pdf'):
+    from reportlab.pdfgen.canvas import Canvas
 
     can = Canvas(fp_out.as_posix())
 
@@ -345,123 +538,3 @@ def test_draw(rect, img_fp=TEST_IMG_FP,
     print(actual)
     can.showPage()
     can.save()
-
-
-def tag_stage_imgs(urls, pcs_profile_url=None):
-    """
-    For a list of urls, return a list of {url: xx, tag: yy}
-    NB purpose is to assign 'route' and 'profile' tags
-
-    For PCS the profile url is known, and may be provided here
-    (NB this might be in http, not https lol)
-    """
-
-    if not urls:
-        print('no urls to tag')
-        return
-
-    imgs = {url: split_img_url(url) for url in urls}
-    source = list(imgs.values())[0]['source']
-
-    out = []  # will be a list of {'url': url, 'tag': tag}
-
-    profile, route = False, False
-
-    # first the case where a profile url is provided
-    if pcs_profile_url is not None:
-        url = pcs_profile_url.replace("http://", "https://")
-        if url in imgs:
-            out.append({'url': url, 'tag': 'profile'})
-            del imgs[url]
-
-        profile = True
-
-    if not profile:
-        for url, elems in imgs.items():
-            if elems['title'] == 'profile':
-                out.append({'url': url, 'tag': 'profile'})
-                del imgs[url]
-                break
-
-    # now the route
-    for url, elems in imgs.items():
-        if elems['title'] in ['route', 'map']:
-            out.append({'url': url, 'tag': 'route'})
-            del imgs[url]
-            break
-
-    # for pcs, it might be the first profile remaining
-    if profile and not route and source == 'pcs':
-        for url, elems in imgs.items():
-            if elems['title'] == 'profile':
-                out.append({'url': url, 'tag': 'route'})
-                del imgs[url]
-                break
-
-    # tag remaining urls as other
-    for url, elems in imgs.items():
-        out.append({'url': url, 'tag': 'other'})
-
-    return out
-
-
-def split_img_url(url):
-    """
-    Return the salient elements of the url, splitting out recognizable
-    elements like f_ext.
-    Does not attempt to assign a type, but the naively reported title
-    may be the same as the type, especially for cs.
-    """
-
-    out = {
-        'url': url.split('/')[-1],
-        'title': None,  # eg 'route-finale' or 'galibier'
-        'source': None,  # 'cs' or 'pcs'
-        'f_ext': url.split('.')[-1],
-        'ind': None,  # pcs has this
-        'extra_payload': None,  # catch-all
-    }
-
-    if 'cyclingstage.com' in url:
-
-        out['source'] = 'cs'
-
-        # this filters out the overall route img
-        if 'stage-' not in url:
-            title, f_ext = out['url'].split('.')
-            stage = None
-
-        else:
-            stage, title, f_ext = re.search(
-                r'stage-(\d{1,2})-(.*)\.(\w*)', url).groups()
-
-        out['title'] = title
-        out['stage'] = stage
-        out['f_ext'] = f_ext
-
-    elif 'procyclingstats.com' in url:
-        out['source'] = 'pcs'
-
-        # this filters out the overall route img
-        if 'stage-' not in url and 'map' in url:
-            out['f_ext'] = out['url'].split('.')[-1]
-            out['title'] = 'overall_route'
-            out['stage'] = None
-
-        else:
-            stage, payload, f_ext = re.search(
-                r'stage-(\d{1,2})-(.*)\.(\w*)', url).groups()
-
-            elems = payload.split('-')
-
-            for elem in elems:
-                if elem in ['map', 'profile', 'finish', 'climb']:
-                    out['title'] = elem
-                if len(elem) == 2:  # i think always of form eg n2
-                    out['ind'] = elem
-                else:
-                    out['extra_payload'] = elem
-
-            out['stage'] = stage
-
-    return out
@@ -2,21 +2,26 @@
 Scrape and parse the cyclingstage site just from main url
 """
 from pathlib import Path
-import json
 import pandas as pd
-from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.units import cm
 
-from .Stage import Stage
-from .Image import Image, draw_img
+from .Stage import Stage, stage_resources
+from .Image import Image, draw_img, download_images
 from .constants import DATA_DIR
 from .urls import make_pcs_url, make_cs_url
 from .get_teams import make_teams_dict
 from .parse_cs import parse_cs_race_html
-from .get_resources import get_resource
+from .get_resources import get_resource, fetch_resources, is_newer
+from . import store
+from .serial import read_json, write_json
+from .cache_policy import get_race_start
+from .snapshot import load_snapshot, save_snapshot
+from .context import RaceContext, make_race_climbs_df
+from .img_urls import classify_img_urls
+from .session import log_connection_stats
 from .drawing.Rect import Rect
-from .drawing.roadbook import print_roadbook
-from .drawing.layouts import PORTRAIT
+# NB the drawing (reportlab Canvas etc) is imported when used, so just
+# loading a race is quicker
 
 """
 TODO:
@@ -32,7 +37,8 @@ TODO:
 class Race:
 
     def __init__(self, race=None, dpath=None,
-                 check=True, verbose=False):
+                 check=True, verbose=False, prefetch=True,
+                 use_store=False, snapshot=True):
         """
         Essentially a wrapper around cyclingstage.com and
         procyclingstats pages / apis for a race, its stages and images
@@ -69,6 +75,18 @@ class Race:
 
         calibrate profile img km scales manually -> calibration.csv
         >>> dp.calibrate()
+
+        By default any missing cs / pcs resources for the race and its
+        stages are fetched in parallel up front (see prefetch())
+
+        Pass use_store=True to keep the cached resources in a single file
+        in the race dir rather than lots of small ones (see store.py).
+        Once made, the store is always used for the race
+
+        Once built, the race is saved to a snapshot in its dir, and
+        loaded from that next time if none of its cache files have changed
+        or gone stale (see snapshot.py).  Pass snapshot=False to always
+        build from the cache files
         """
 
         # filesystem and naming etc
@@ -86,6 +104,15 @@ class Race:
 
         self._calibration_csv_dpath = self.dpath / 'calibration.csv'
 
+        store.open_store(self.dpath, create=use_store)
+
+        self._use_snapshot = snapshot
+        if snapshot:
+            race = load_snapshot(self.dpath)
+            if race is not None:
+                self.__dict__.update(race.__dict__)
+                return
+
         if not self.dpath.exists():
             print('making new race dir', self.dpath)
             self.dpath.mkdir()
@@ -98,6 +125,10 @@ class Race:
                 self._cal_df = pd.read_csv(self._calibration_csv_dpath,
                                            index_col='stage')
 
+        # what the stages share with the race - the race-level pcs data,
+        # the index of image dimensions etc, see context.py
+        self._ctx = RaceContext(self._race, self.dpath)
+
         self._cs_url = make_cs_url(self._race)
         self._pcs_url = make_pcs_url(self._race)
 
@@ -109,6 +140,13 @@ class Race:
         self._pcs_profile_img_urls = None
         self._pcs_route_img_url = None
         self._pcs_startlist = None
+        # the start date sets how long cached resources stay fresh,
+        # see cache_policy.py
+        self._race_start = None
+        self._race_start = get_race_start(
+            get_resource(**self._resources()['_pcs_race']))
+        if prefetch:
+            self.prefetch()
         self._load()
 
         # PROCESSING
@@ -121,73 +159,87 @@ class Race:
 
         self.stages = self.make_stages()
         # all data now loaded, can make roadbook
+        # (images are downloaded when first needed, see download_imgs())
+
+        if snapshot:
+            save_snapshot(self)
 
 
     # load external resources or their caches with get_resource()
     # see the parsing functions for each resource in get_resource.py
+    def _resources(self):
+        """
+        The external resources for the race, as get_resource() kwargs
+        keyed by the attr they are loaded to
+        """
+        return race_resources(self._race, self.dpath, self._race_start)
+
     def _load(self, update=False):
-        # the raw cs html is useful
-        self._cs_html = get_resource(
-            url=self._cs_url,
-            fpath=self.dpath / '.cs.html',
-            parser='html',
-            update=update
-        )
-        # the main pcs source
-        self._pcs_race = get_resource(
-            url=self._pcs_url,
-            fpath=self.dpath / '.pcs_race.json',
-            parser='pcs_race_api',
-            update=update
-        )
-        # pcs Race api has a list of all climbs, with full data
-        # - not used in Race object - is read from disk by Stage objects
-        self._pcs_race_climbs = get_resource(
-            url=f"{self._pcs_url}/route/climbs",
-            fpath=self.dpath / '.pcs_race_climbs.json',
-            parser='pcs_race_climbs_api',
-            update=update
-        )
-        # pcs race page has handy list of all profile imgs
-        # - not used in Race object - read from disk by Stage objects
-        self._pcs_profile_img_urls = get_resource(
-            url=make_pcs_url(self._race, kind='stage_profile_urls'),
-            fpath=self.dpath / '.pcs_profile_img_urls.json',
-            parser='pcs_profile_img_urls',
-            update=update
-        )
-        # the pcs img for overall route
-        self._pcs_route_img_url = get_resource(
-            url=make_pcs_url(self._race, kind='route_img'),
-            fpath=self.dpath / '.pcs_route_img_url.json',
-            parser='pcs_route_img_url',
-            update=update
-        )
-        # the pcs startlist - used for teams
-        self._pcs_startlist = get_resource(
-            url=make_pcs_url(self._race, kind='startlist'),
-            fpath=self.dpath / '.pcs_startlist.json',
-            parser='pcs_startlist',
-            update=update
-    )
+        for attr, resource in self._resources().items():
+            setattr(self, attr, get_resource(**resource, update=update))
+
+        self._race_start = get_race_start(self._pcs_race)
+
+        # share with the stages, rather than each reading from disk
+        self._ctx.race_start = self._race_start
+        self._ctx.pcs_profile_img_urls = self._pcs_profile_img_urls
+        self._ctx.race_climbs = make_race_climbs_df(self._pcs_race_climbs)
+
+    def prefetch(self, update=False, stages=True,
+                 max_workers=8, per_host=None):
+        """
+        Fill the caches for the race and all its stages in parallel,
+        before any parsing is done.  Only missing or stale resources are
+        fetched, unless update=True.
+
+        The race resources go first, as the number of stages comes
+        from the pcs race data
+        """
+        fetch_resources(self._resources().values(), update=update,
+                        max_workers=max_workers, per_host=per_host)
+
+        if not stages:
+            return
+
+        pcs_race = get_resource(**self._resources()['_pcs_race'])
+
+        if pcs_race is None:
+            print('no pcs race data, cannot prefetch stages')
+            return
+
+        resources = []
+        for i, _ in enumerate(pcs_race['stages']):
+            resources.extend(
+                stage_resources(self._race, i + 1, self.dpath,
+                                race_start=get_race_start(pcs_race)).values())
+
+        fetch_resources(resources, update=update,
+                        max_workers=max_workers, per_host=per_host)
+
+        log_connection_stats()
 
     def _process(self):
         # parse the cs html
-        if (self.dpath / '.cs_data.json').exists():
-            with open(self.dpath / '.cs_data.json', 'r') as fp:
-                self._cs_data = json.load(fp)
+        # (re)parse if the html has been refetched since
+        if (store.exists(self.dpath / '.cs_data.json')
+                and not is_newer(self.dpath / '.cs.html',
+                                 self.dpath / '.cs_data.json')):
+            self._cs_data = read_json(self.dpath / '.cs_data.json')
         else:
             self._cs_data = parse_cs_race_html(self._cs_html)
-            with open(self.dpath / '.cs_data.json', 'w') as fp:
-                json.dump(self._cs_data, fp, indent=4)
+            write_json(self._cs_data, self.dpath / '.cs_data.json')
 
         # make the teams
         self.teams = make_teams_dict(self._pcs_startlist)
 
         self.cs_route_img = Image(self._cs_data['route_img_url'],
-                                  self.dpath, fname='cs_route_img')
+                                  self.dpath, fname='cs_route_img',
+                                  race_start=self._race_start,
+                                  index=self._ctx.img_index)
         self.pcs_route_img = Image(self._pcs_route_img_url,
-                                   self.dpath, fname='pcs_route_img')
+                                   self.dpath, fname='pcs_route_img',
+                                   race_start=self._race_start,
+                                   index=self._ctx.img_index)
 
     def make_stages(self):
         """
@@ -196,10 +248,48 @@ class Race:
         stages = []
 
         for i, stage in enumerate(self._pcs_race['stages']):
-            stages.append(Stage(self._race, i + 1, check=True))
+            stages.append(Stage(self._race, i + 1, race_dpath=self.dpath,
+                                check=True, ctx=self._ctx))
 
         return stages
 
+    def img_urls_df(self):
+        """
+        All the cs and pcs image urls for the race's stages, classified
+        in one go (see img_urls.classify_img_urls)
+        """
+        urls = []
+        for st in self.stages:
+            urls.extend(st._cs_data.get('img_urls') or [])
+            urls.extend(st._pcs_img_urls or [])
+
+        return classify_img_urls(urls)
+
+    def all_imgs(self, others=True):
+        """
+        The Images for the race and its stages (None where missing).
+        Pass others=False to skip the imgs tagged 'other'
+        """
+        imgs = [self.cs_route_img, self.pcs_route_img]
+
+        for st in self.stages:
+            for tags in st.imgs().values():
+                imgs.extend([tags['profile'], tags['route']])
+                if others:
+                    imgs.extend(tags['others'])
+
+        return imgs
+
+    def download_imgs(self, others=True, max_workers=8):
+        """
+        Download all missing (or stale) images for the race and its
+        stages in one concurrent batch, rather than one by one as they
+        are drawn.
+        Pass others=False to skip the imgs tagged 'other'
+        """
+        return download_images(self.all_imgs(others),
+                               max_workers=max_workers)
+
 
     def check(self, verbose=False):
         """
@@ -223,12 +313,12 @@ class Race:
                     print('cannot check stage', st.stage_no)
 
         print('\nchecking race..')
-        if not self.cs_route_img.fpath.exists():
+        if self.cs_route_img.url is None:
             out.append('cs_route_img')
         elif verbose:
             print(' cs_route_img'.ljust(pad), ': ok')
 
-        if not self.cs_route_img.fpath.exists():
+        if self.pcs_route_img.url is None:
             out.append('pcs_route_img')
         elif verbose:
             print(' pcs_route_img'.ljust(pad), ': ok')
@@ -237,15 +327,23 @@ class Race:
 
         print(f'\nFound {missing} missing params')
 
-    def print_roadbook(self, km_to_go=False):
+    def print_roadbook(self, km_to_go=False, parallel=False,
+                       incremental=False):
         """
         Get a canvas
         Draw front page
         For each stage:
             draw stage(pages=1 or 2)
         Draw teams
+
+        Pass parallel=True to draw the pages on all cores and merge them
+        Pass incremental=True to only redraw pages whose inputs changed
         """
-        print_roadbook(self, km_to_go=km_to_go)
+        from .drawing.roadbook import print_roadbook
+
+        self.download_imgs(others=False)
+        print_roadbook(self, km_to_go=km_to_go, parallel=parallel,
+                       incremental=incremental)
 
     def df(self):
         """
@@ -271,16 +369,16 @@ class Race:
         for stage in self.stages:
             if stages is not None and stage._stage_ind + 1 not in stages:
                 continue
-            for j in stage.dpath.iterdir():
+            for j in store.list_files(stage.dpath):
                 if j.name.endswith('json'):
                     if tags is None:
                         print('clearing', j)
-                        j.unlink()
+                        store.delete(j)
                         continue
                     for tag in tags:
                         if tag in j.name:
                             print('clearing', j)
-                            j.unlink()
+                            store.delete(j)
 
     def calibrate(self, left=None, right=None, source='pcs', cal_lims=None):
         """
@@ -291,6 +389,8 @@ class Race:
         Pass a tuple of cal_lims for (mm down from img top, mm up from img bottom)
         for how far up and down to draw the calibration (defaults are sane)
         """
+        from reportlab.pdfgen.canvas import Canvas
+        from .drawing.layouts import PORTRAIT
 
         if left is None:
             left = PORTRAIT.left
@@ -298,6 +398,8 @@ class Race:
         if right is None:
             right = PORTRAIT.right
 
+        self.download_imgs(others=False)
+
         fp = self.dpath / f'calibrate_{source}_profiles.pdf'
         can = Canvas(fp.as_posix())
 
@@ -311,7 +413,7 @@ class Race:
             rect.top -= 0.8
             img = st.imgs()['pcs']['profile']
 
-            actual = draw_img(img.fpath, rect, canvas=can, add_calibration=True,
+            actual = draw_img(img, rect, canvas=can, add_calibration=True,
                               cal_lims=cal_lims)
 
             # stop after 2
@@ -333,14 +435,22 @@ class Race:
             teams finalized (a few days before start)
             climbs - race and stage
             missing imgs added
+
+        If the race has a store, nothing is saved to it unless the whole
+        update succeeds
         """
+        with store.transaction(self.dpath):
+            self.prefetch(update=True, stages=update_stages)
+            self._load()
+            self._process()
 
-        self._load(update=True)
-        self._process
+            if update_stages:
+                for stage in self.stages:
+                    stage._load()
+                    stage._process()
 
-        if update_stages:
-            for stage in self.stages:
-                stage.update()
+        if self._use_snapshot:
+            save_snapshot(self)
 
     def __repr__(self):
 
@@ -354,6 +464,65 @@ class Race:
         return "\n".join(out)
 
 
+def race_resources(race, dpath, race_start=None):
+    """
+    The external resources for a race, as get_resource() kwargs
+    keyed by the attr they are loaded to.
+
+    A function so that several races' resources can be fetched together
+    (see batch.py) without making the Race objects first
+    """
+    dpath = Path(dpath)
+    pcs_url = make_pcs_url(race)
+
+    return {
+        # the raw cs html is useful
+        '_cs_html': dict(
+            url=make_cs_url(race),
+            fpath=dpath / '.cs.html',
+            parser='html',
+            race_start=race_start,
+        ),
+        # the main pcs source
+        '_pcs_race': dict(
+            url=pcs_url,
+            fpath=dpath / '.pcs_race.json',
+            parser='pcs_race_api',
+            race_start=race_start,
+        ),
+        # pcs Race api has a list of all climbs, with full data
+        # - passed to the Stage objects in the RaceContext
+        '_pcs_race_climbs': dict(
+            url=f"{pcs_url}/route/climbs",
+            fpath=dpath / '.pcs_race_climbs.json',
+            parser='pcs_race_climbs_api',
+            race_start=race_start,
+        ),
+        # pcs race page has handy list of all profile imgs
+        # - not used in Race object - passed to Stage objects in ctx
+        '_pcs_profile_img_urls': dict(
+            url=make_pcs_url(race, kind='stage_profile_urls'),
+            fpath=dpath / '.pcs_profile_img_urls.json',
+            parser='pcs_profile_img_urls',
+            race_start=race_start,
+        ),
+        # the pcs img for overall route
+        '_pcs_route_img_url': dict(
+            url=make_pcs_url(race, kind='route_img'),
+            fpath=dpath / '.pcs_route_img_url.json',
+            parser='pcs_route_img_url',
+            race_start=race_start,
+        ),
+        # the pcs startlist - used for teams
+        '_pcs_startlist': dict(
+            url=make_pcs_url(race, kind='startlist'),
+            fpath=dpath / '.pcs_startlist.json',
+            parser='pcs_startlist',
+            race_start=race_start,
+        ),
+    }
+
+
 def make_calibration_csv(dpath, no_days=21, default_margins=None,
                          overwrite=False):
     """
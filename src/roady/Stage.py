@@ -1,22 +1,23 @@
 from pathlib import Path
-import requests
 from datetime import datetime
-import json
 import pandas as pd
-import procyclingstats
 
 from .constants import DATA_DIR, LOG
 from .urls import make_cs_url, make_pcs_url 
-from .Image import Image, tag_stage_imgs
+from .Image import Image
+from .img_urls import tag_stage_imgs
 from .parse_cs import parse_cs_stage_html
-from .get_resources import get_resource
+from .get_resources import get_resource, is_newer
+from . import store
+from .serial import read_json, write_json
+from .context import RaceContext
 from .get_gc import get_stage_gc, print_stage_gc
 
 
 class Stage:
 
     def __init__(self, race, stage_no, race_dpath=None, check=False,
-                 get_gc=False):
+                 get_gc=False, ctx=None):
         """
 
         Wrapper for cs and pcs data using passed race, number and optional dpath
@@ -34,6 +35,11 @@ class Stage:
         Instantiates Image objects which do similar with the image files
 
         Tags image urls as 'profile', 'route', 'other'
+
+        Race passes its RaceContext as ctx, with the race start date (for
+        refetching stale resources, see cache_policy.py), the race-level
+        pcs data, ImageIndex etc, so they are only loaded once for all
+        stages.  Made from the race dir if not passed
         """
 
         # infer main things from the cs_url
@@ -58,6 +64,10 @@ class Stage:
 
         self.dpath = Path(race_dpath) / f"stage_{self.stage_no}"
 
+        if ctx is None:
+            ctx = RaceContext(self._race, self.dpath.parent)
+        self._ctx = ctx
+
         if not self.dpath.exists():
             self.dpath.mkdir()
 
@@ -73,52 +83,44 @@ class Stage:
         self._img_urls_tags = None
         self.data = None
         self.climbs_df = None
+        self._imgs = None
         self._process()
 
         # probably most important: profile and route imgs
         # can edit img_urls_tags.json to get these right,
-        # and call self.imgs() directly
-        _ = self.imgs()
+        # and call self.imgs(refresh=True) directly
+        # NB the Images are lazy, nothing downloaded until drawn
 
         if check:
             self.check()
 
     def _load(self, update=False):
-        self._cs_html = get_resource(
-            url=self._cs_url,
-            fpath=self.dpath / '.cs.html',
-            parser='html',
-            update=update
-        )
+        resources = stage_resources(self._race, self.stage_no,
+                                    self.dpath.parent, self._ctx.race_start)
+
+        self._cs_html = get_resource(**resources['_cs_html'], update=update)
 
         # handy to finish parsing cs_html right now, so 
-        if (self.dpath / '.cs_data.json').exists():
-            with open(self.dpath / '.cs_data.json', 'r') as fp:
-                self._cs_data = json.load(fp)
+        # (re)parse if the html has been refetched since
+        if (store.exists(self.dpath / '.cs_data.json')
+                and not is_newer(self.dpath / '.cs.html',
+                                 self.dpath / '.cs_data.json')):
+            self._cs_data = read_json(self.dpath / '.cs_data.json')
         else:
             self._cs_data = parse_cs_stage_html(self._cs_html)
-            with open(self.dpath / '.cs_data.json', 'w') as fp:
-                json.dump(self._cs_data, fp, indent=4)
+            write_json(self._cs_data, self.dpath / '.cs_data.json')
 
         # the main pcs Stage api data (file hidden)
-        # note this is
-        self._pcs_data = get_resource(
-            url=self._pcs_data_url,
-            fpath=self.dpath / '.pcs_data.json',
-            parser='pcs_stage_api',
-            update=update
-        )
+        self._pcs_data = get_resource(**resources['_pcs_data'],
+                                      update=update)
 
         # pcs img urls (file hidden - see tagged version on disk)
-        self._pcs_img_urls = get_resource(
-            url=self._pcs_img_urls_source_url,
-            fpath=self.dpath / '.pcs_img_urls.json',
-            parser='pcs_stage_img_urls',
-            update=update
-        )
+        self._pcs_img_urls = get_resource(**resources['_pcs_img_urls'],
+                                          update=update)
 
     def _process(self):
         self._img_urls_tags = tag_imgs(self)
+        self._imgs = None
         self.data = self._make_data()
         self.climbs_df = self._make_climbs_df()
 
@@ -144,13 +146,19 @@ class Stage:
 
         return out
 
-    def imgs(self):
+    def imgs(self, refresh=False):
         """
         Return dict of Images for cs and pcs profile and route,
         based on their tags in img_urls_tags.json
 
         Go through self._img_urls_tags and just assign
+
+        Made once per stage - pass refresh=True to remake, eg after
+        editing img_urls_tags.json (and re-running _process())
         """
+        if self._imgs is not None and not refresh:
+            return self._imgs
+
         out = {
             'pcs': {'profile': None, 'route': None, 'others': []},
             'cs': {'profile': None, 'route': None, 'others': []},
@@ -170,15 +178,21 @@ class Stage:
                     if out[source]['profile'] is not None:
                         print('two profiles found')
                     out[source]['profile'] = Image(
-                        img['url'], dpath, tag='profile')
+                        img['url'], dpath, tag='profile',
+                        race_start=self._ctx.race_start,
+                        index=self._ctx.img_index)
                 elif img['tag'] == 'route':
                     if out[source]['route'] is not None:
                         print('two routes found')
                     out[source]['route'] = Image(
-                        img['url'], dpath, tag='route')
+                        img['url'], dpath, tag='route',
+                        race_start=self._ctx.race_start,
+                        index=self._ctx.img_index)
                 elif img['tag'] == 'other':
                     out[source]['others'].append(
-                        Image(img['url'], dpath, tag='other'))
+                        Image(img['url'], dpath, tag='other',
+                              race_start=self._ctx.race_start,
+                              index=self._ctx.img_index))
 
             if out[source]['profile'] is None:
                 LOG.info(f'no {source} profile for stage, {self.stage_no}')
@@ -189,45 +203,41 @@ class Stage:
         # SOMTHING WAS MISSING HERE
         # incl make_climbs_df declaration
 
+        self._imgs = out
+
         return out
 
     def _make_climbs_df(self):
         """
-        Get the race climbs from race dir
+        Get the detailed race climbs from the race context (see
+        make_race_climbs_df) and join the stage climbs to them by url
         """
 
         if not self._pcs_data.get('climbs'):
             return pd.DataFrame()
 
-        # need to load the full detailed climbs from race dir above
-        race_climbs_fp = self.dpath.parent / '.pcs_race_climbs.json'
+        race_climbs = self._ctx.race_climbs
 
-        if not race_climbs_fp.exists():
-            print('cannot find a parent directory with pcs climb details')
+        if race_climbs.empty:
+            print('cannot find the race pcs climb details')
             return pd.DataFrame()
 
-        with open(race_climbs_fp, 'r') as fp:
-            race_climbs = json.load(fp)
-
-        out = []
-
         # go through the stage climbs (less detailed)
-        for stage_climb in self._pcs_data['climbs']:
+        # use the climb url as key to get its detail
+        urls = pd.Series([x['climb_url'] for x in self._pcs_data['climbs']],
+                         name='url')
 
-            # use the climb url as key to get its detail
-            records = [x for x in race_climbs
-                       if x['climb_url'] ==  stage_climb['climb_url']]
-            if not records:
+        missing = ~urls.isin(race_climbs.index)
+        for stage_climb, is_missing in zip(self._pcs_data['climbs'], missing):
+            if is_missing:
                 print('cannot find', stage_climb['climb_name'],
                       'in race climbs')
-            out.extend(records)
 
-        if not out:
+        df = urls.to_frame().join(race_climbs, on='url', how='inner')
+
+        if df.empty:
             return pd.DataFrame()
 
-        df = pd.DataFrame(out)
-        df.columns = ['name', 'url', 'length_km',
-                      'perc', 'alt_m', 'km_to_go']
         df['start_km_to_go'] = df['km_to_go'] + df['length_km']
         df['km'] = self.data['distance'] - df['km_to_go']
         df['start_km'] = df['km'] - df['length_km']
@@ -359,14 +369,45 @@ class Stage:
         """
         """
         self._load(update=True)
-        self._process
-        # imgs too??
+        self._process()
 
 
     def __repr__(self):
         return f"Stage('{self._cs_url}')"
 
 
+def stage_resources(race, stage_no, race_dpath, race_start=None):
+    """
+    The external resources for a stage, as get_resource() kwargs
+    keyed by the attr they are loaded to.
+
+    A function so that Race can collect these for all its stages (and
+    fetch them in parallel) without making the Stage objects first
+    """
+    dpath = Path(race_dpath) / f"stage_{stage_no}"
+
+    return {
+        '_cs_html': dict(
+            url=make_cs_url(race, stage_no),
+            fpath=dpath / '.cs.html',
+            parser='html',
+            race_start=race_start,
+        ),
+        '_pcs_data': dict(
+            url=make_pcs_url(race, 'stage', stage_no),
+            fpath=dpath / '.pcs_data.json',
+            parser='pcs_stage_api',
+            race_start=race_start,
+        ),
+        '_pcs_img_urls': dict(
+            url=make_pcs_url(race, 'stage_resources', stage_no),
+            fpath=dpath / '.pcs_img_urls.json',
+            parser='pcs_stage_img_urls',
+            race_start=race_start,
+        ),
+    }
+
+
 def tag_imgs(stage):
     """
     # unify image tagging, single json with a list of urls
@@ -382,17 +423,16 @@ def tag_imgs(stage):
     TODO
     If a stage is missing an image tagged as profile or route,
     can go into the disk files (img_urls_tags.json) and
-    assign manually.
+    assign manually (if the race has a store, get it out with
+    store.export_files(race_dpath) and back with store.import_files()).
     """
     self = stage  # while in dev
 
     fpath = self.dpath / 'img_urls_tags.json'
 
-    # if json is on disk, just return it
-    if fpath.exists():
-        with open(fpath, 'r') as fp:
-            out = json.load(fp)
-        return out
+    # if json is on disk (or in the race store), just return it
+    if store.exists(fpath):
+        return read_json(fpath)
 
     # making it
     out = {
@@ -404,9 +444,7 @@ def tag_imgs(stage):
     out['cs'] = tag_stage_imgs(self._cs_data['img_urls'])
 
     # for pcs want to use the parent race list of profile urls
-    with open(self.dpath.parent
-              / '.pcs_profile_img_urls.json', 'r') as fp:
-        pcs_profile_urls = json.load(fp)
+    pcs_profile_urls = self._ctx.pcs_profile_img_urls or []
 
     if self._stage_ind < len(pcs_profile_urls):
         profile_url = pcs_profile_urls[self._stage_ind]
@@ -417,8 +455,8 @@ def tag_imgs(stage):
 
     out['pcs'] = tag_stage_imgs(self._pcs_img_urls, profile_url)
 
-    with open(fpath, 'w') as fp:
-        json.dump(out, fp, indent=4)
+    # written indented, for editing by hand
+    write_json(out, fpath)
 
     return out
 
@@ -1,37 +1,61 @@
 import argparse
 import sys
 
-from .Roady import Roady
-from .get_gc import update_tour_gcs, print_stage_gc
+# NB the rest of roady is imported in main(), just for what's being done,
+# so that the cli starts quickly (see _debug_utils.bench_imports)
 
 def main():
 
     parser = argparse.ArgumentParser(
-        epilog=('make the passed tour, eg "france 23"')
+        epilog=('make the passed tour, eg "tour 23", or several at once, '
+                'eg "tour,giro 25", or the whole season "all 25"')
     )
 
-    parser.add_argument('country', type=str, help='the country')
+    parser.add_argument('country', type=str,
+                        help='the race, a comma separated list, or "all"')
     parser.add_argument('year', type=int, help='the year eg "23"')
     parser.add_argument('-c', '--update-gc',
                         action='store_true', default=False,
                         help="update gc standings pdfs for stages")
     parser.add_argument('stage', type=int, nargs='?',
                         help='the stage to update gc')
+    parser.add_argument('-u', '--update',
+                        action='store_true', default=False,
+                        help="refetch everything (for several races)")
+    parser.add_argument('--per-host', type=int, default=None,
+                        help="max requests at a time to any one site")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes for drawing roadbooks")
 
     args = parser.parse_args()
 
     if args.update_gc:
         yr = int(args.year) + 2000
         if args.stage is None:
+            from .get_gc import update_tour_gcs
             print(f'looking to update gc for {args.country} {yr}')
             update_tour_gcs(args.country, yr)
         else:
+            from .get_gc import print_stage_gc
             print(f'updating gc for {args.country} {yr} stage {args.stage}')
-            print_stage_gc(args.stage, args.country, yr)
+            print_stage_gc(args.stage, f"{args.country}_{yr}")
             
+    elif args.country == 'all' or ',' in args.country:
+        from .batch import build_races, season_races
+
+        if args.country == 'all':
+            races = season_races(args.year)
+        else:
+            races = [f"{x.strip()}_{args.year}"
+                     for x in args.country.split(',')]
+
+        build_races(races, update=args.update, per_host=args.per_host,
+                    render_workers=args.workers)
+
     else:
-        rd = Roady(args.country, args.year)
-        rd.make_roadbook_pdf()
+        from .Race import Race
+        rd = Race(f"{args.country}_{args.year}")
+        rd.print_roadbook()
 
 if __name__ == '__main__':
     sys.exit(main())
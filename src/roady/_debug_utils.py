@@ -24,3 +24,241 @@ def print_stage_img_urls(stage, cs=True, pcs=True):
         print('pcs')
         for img in stage.pcs_imgs:
             print(img.url.split('/')[-1])
+
+
+def bench_parse_cs(dpath=None, repeat=3):
+    """
+    Time parse_cs_stage_html over all the cached stage .cs.html files
+    under dpath (default all races), with each available parser backend
+    """
+    import time
+    from . import parse_cs
+    from .constants import DATA_DIR
+
+    if dpath is None:
+        dpath = DATA_DIR
+
+    fixtures = [fp.read_text() for fp in dpath.glob('**/stage_*/.cs.html')]
+
+    if not fixtures:
+        print('no cached .cs.html files under', dpath)
+        return
+
+    backends = ['html.parser']
+    if parse_cs.PARSER != 'html.parser':
+        backends.append(parse_cs.PARSER)
+
+    default = parse_cs.PARSER
+    out = {}
+
+    try:
+        for backend in backends:
+            parse_cs.PARSER = backend
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for html in fixtures:
+                    try:
+                        parse_cs.parse_cs_stage_html(html)
+                    except Exception:
+                        pass
+            secs = (time.perf_counter() - start) / (repeat * len(fixtures))
+            out[backend] = secs
+            print(f'{backend.ljust(12)}: {secs * 1000:.1f}ms per page')
+    finally:
+        parse_cs.PARSER = default
+
+    return out
+
+
+def bench_json_load(dpath=None, repeat=5):
+    """
+    Time loading all the cached json files under dpath (default all
+    races), with stdlib json and serial.loads (orjson if installed),
+    as they are on disk and as written compact now
+    """
+    import json
+    import time
+    from . import serial
+    from .constants import DATA_DIR
+
+    if dpath is None:
+        dpath = DATA_DIR
+
+    fixtures = [fp.read_text() for fp in dpath.glob('**/.*.json')
+                if not fp.name.endswith('.meta.json')]
+
+    if not fixtures:
+        print('no cached json files under', dpath)
+        return
+
+    compact = [serial.dumps(serial.loads(x)) for x in fixtures]
+
+    print(f'{len(fixtures)} files, '
+          f'{sum(map(len, fixtures)) / 1e6:.1f}MB on disk, '
+          f'{sum(map(len, compact)) / 1e6:.1f}MB compact')
+
+    out = {}
+    for name, func, texts in [
+        ('json, on disk', json.loads, fixtures),
+        ('json, compact', json.loads, compact),
+        ('serial, on disk', serial.loads, fixtures),
+        ('serial, compact', serial.loads, compact),
+    ]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                func(text)
+        secs = (time.perf_counter() - start) / repeat
+        out[name] = secs
+        print(f'{name.ljust(16)}: {secs * 1000:.1f}ms for all')
+
+    return out
+
+
+def bench_gc(n_riders=180, repeat=20):
+    """
+    Time making a gc df from a fake pcs gc of n_riders, with
+    get_gc.make_gc_df and with the old per rider apply() of get_secs,
+    get_time_str and the sanitizers.  Pass eg n_riders=4000 for a whole
+    race's worth of stages at once
+    """
+    import random
+    import time
+    import pandas as pd
+    from . import get_gc
+    from .get_teams import TEAMTAGS, sanitize_team, sanitize_rider
+
+    secs = sorted(random.randint(70000, 80000) for _ in range(n_riders))
+    gc_dict = [{
+        'rider_name': f'RIDER{i} Name',
+        'team_name': f'Team {TEAMTAGS[i % 23]} Pro Cycling',
+        'time': get_gc.get_time_str(x),
+        'bonus': get_gc.get_time_str(random.choice([0, 0, 4, 10])),
+    } for i, x in enumerate(secs)]
+
+    def old(gc_dict):
+        df = pd.DataFrame(gc_dict)
+        df['time_s'] = df['time'].apply(get_gc.get_secs)
+        df['gap_s'] = df['time_s'] - df.loc[0, 'time_s']
+        df['gap'] = df['gap_s'].apply(get_gc.get_time_str)
+        df['bonus_s'] = df['bonus'].apply(get_gc.get_secs)
+        df.index += 1
+        df.index.name = 'pos'
+        df['team_name'] = df['team_name'].apply(sanitize_team)
+        df = df[['rider_name', 'team_name', 'gap']]
+        df['rider_name'] = df['rider_name'].apply(sanitize_rider)
+        return df
+
+    out = {}
+    for name, func in [('apply', old), ('make_gc_df', get_gc.make_gc_df)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(gc_dict)
+        secs_taken = (time.perf_counter() - start) / repeat
+        out[name] = secs_taken
+        print(f'{name.ljust(10)}: {secs_taken * 1000:.2f}ms')
+
+    return out
+
+
+# the deps that are slow to import, and should only be loaded when needed
+HEAVY_IMPORTS = ['pandas', 'reportlab.pdfgen.canvas', 'PIL.Image', 'bs4',
+                 'requests', 'procyclingstats']
+
+# for each cli path, the module it imports, what that should import in
+# (ms), and the HEAVY_IMPORTS it needs and so may pull in
+IMPORT_TARGETS = {
+    # python -m roady, before it knows what it is doing
+    'roady.__main__': (150, []),
+    # -c, updating the gcs
+    'roady.get_gc': (600, ['pandas']),
+    # eg "tour 25" - from a snapshot needs nothing more
+    'roady.Race': (600, ['pandas']),
+    # several races, eg "all 25"
+    'roady.batch': (600, ['pandas']),
+}
+
+# end to end, python -m roady ... --help
+CLI_TARGET_MS = 300
+
+
+def bench_imports():
+    """
+    bench_import() each of the IMPORT_TARGETS, and bench_cli().
+    Returns True if all are ok
+    """
+    ok = [bench_import(module) for module in IMPORT_TARGETS]
+
+    return all(ok) and bench_cli()
+
+
+def bench_import(module='roady.__main__', target_ms=None, allowed=None):
+    """
+    Import module in a fresh python with -X importtime, and print the
+    total time and which of the HEAVY_IMPORTS it pulled in.
+    The target and allowed heavy imports are from IMPORT_TARGETS unless
+    passed.  Returns True if it came in under target_ms, with no other
+    heavy imports
+    """
+    import subprocess
+    import sys
+
+    default_ms, default_allowed = IMPORT_TARGETS.get(module, (150, []))
+    if target_ms is None:
+        target_ms = default_ms
+    if allowed is None:
+        allowed = default_allowed
+
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          f'import {module}'],
+                         capture_output=True, text=True)
+
+    if res.returncode != 0:
+        print(res.stderr.splitlines()[-1])
+        return False
+
+    # lines like 'import time:   self [us] | cumulative | imported package'
+    cumulative = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cum, name = line.split('|')
+        cumulative[name.strip()] = int(cum) / 1000
+
+    total = cumulative.get(module, 0)
+    heavy = {k: cumulative[k] for k in HEAVY_IMPORTS if k in cumulative}
+    unwanted = [x for x in heavy if x not in allowed]
+
+    print(f'import {module}: {total:.0f}ms (target {target_ms}ms)')
+    for name, ms in heavy.items():
+        flag = '' if name in allowed else '  NOT WANTED'
+        print(f'    {name.ljust(24)}: {ms:.0f}ms{flag}')
+
+    return total < target_ms and not unwanted
+
+
+def bench_cli(args=('tour', '25', '--help'), target_ms=CLI_TARGET_MS,
+              repeat=3):
+    """
+    Time python -m roady with the passed args end to end, best of
+    repeat, incl starting python.  Returns True if under target_ms
+    """
+    import subprocess
+    import sys
+    import time
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = subprocess.run([sys.executable, '-m', 'roady', *args],
+                             capture_output=True, text=True)
+        times.append((time.perf_counter() - start) * 1000)
+
+        if res.returncode != 0:
+            print(res.stderr.splitlines()[-1])
+            return False
+
+    print(f"python -m roady {' '.join(args)}: {min(times):.0f}ms "
+          f"(target {target_ms}ms)")
+
+    return min(times) < target_ms
@@ -0,0 +1,261 @@
+"""
+Build many races at once, eg the whole season:
+
+>>> build_season(2025)
+>>> build_races(['tour_2025', 'giro_2025'], update=True)
+
+Rather than each race fetching, downloading and drawing on its own, each
+step is done for all the races together:
+    - fetch the missing / stale resources for all the races, then all
+      their stages, on one thread pool
+    - make the Race objects (from their snapshots if nothing has changed,
+      see snapshot.py)
+    - download the images for all the races on the same pool
+    - draw the roadbooks on a process pool, a race per worker
+
+Requests to any one host are capped across all of it (see
+session.host_slot), so a season doesn't hammer pcs any harder than
+one race.
+
+Prints a timing summary per race at the end, and returns it as a df.
+A race that fails is reported in the summary, and the rest carry on.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import time
+import pandas as pd
+
+from .constants import DATA_DIR, LOG
+from .urls import CS_PARTS, PCS_URL_BASES
+from .Race import Race, race_resources
+from .Stage import stage_resources
+from .get_resources import get_resource, fetch_resources
+from .cache_policy import get_race_start
+from .Image import download_images
+from .session import log_connection_stats
+from . import session
+from . import store
+
+
+def season_races(year):
+    """
+    The races there are both cs and pcs urls for, eg 'tour_2025'
+    """
+    year = int(year)
+
+    if year < 100:
+        year += 2000
+
+    return [f"{name}_{year}" for name in CS_PARTS if name in PCS_URL_BASES]
+
+
+def build_season(year, **kwargs):
+    """
+    build_races() for all the races in the year, see season_races()
+    """
+    return build_races(season_races(year), **kwargs)
+
+
+def build_races(races, update=False, roadbooks=True, km_to_go=False,
+                incremental=True, fetch_workers=16, render_workers=None,
+                per_host=None):
+    """
+    Fetch, build and draw the roadbooks for the passed races,
+    eg ['tour_2025', 'giro_25'].
+
+    Pass update=True to refetch everything, as Race.update()
+    Pass roadbooks=False to just fill the caches and download imgs.
+    per_host sets the limit of requests at a time to any one host
+    (default session.PER_HOST)
+    """
+    if per_host is not None:
+        session.configure(per_host=per_host)
+
+    races = [normalise_race(x) for x in races]
+    timings = {race: defaultdict(float) for race in races}
+    errors = {}
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as pool:
+
+        print(f'fetching for {len(races)} races')
+        fetch_all(races, update, pool, timings, errors)
+        fetched_at = time.perf_counter()
+
+        print('building races')
+        built = build_all([x for x in races if x not in errors],
+                          timings, errors)
+        built_at = time.perf_counter()
+
+        print('downloading images')
+        download_all(built, pool, timings)
+        downloaded_at = time.perf_counter()
+
+    log_connection_stats()
+
+    if roadbooks:
+        print('drawing roadbooks')
+        render_all(built, km_to_go, incremental, render_workers,
+                   timings, errors)
+
+    df = make_summary(timings, errors)
+
+    print()
+    print(df.to_string())
+    print(f"\nfetch {fetched_at - start:.1f}s, "
+          f"build {built_at - fetched_at:.1f}s, "
+          f"images {downloaded_at - built_at:.1f}s, "
+          f"total {time.perf_counter() - start:.1f}s")
+
+    return df
+
+
+def normalise_race(race):
+    """
+    'tour_25' -> 'tour_2025', as Race does
+    """
+    name, edition = race.split('_')
+
+    if len(edition) == 2:
+        edition = f"20{edition}"
+
+    return f"{name}_{edition}"
+
+
+def fetch_all(races, update, pool, timings, errors):
+    """
+    Fill the caches for all the races and their stages.  The pcs race
+    data goes first, as it has the start dates and number of stages
+    """
+    fetched = []
+    dpaths = {race: DATA_DIR / race for race in races}
+
+    # so races with a store are checked and filled in that, see store.py
+    for dpath in dpaths.values():
+        store.open_store(dpath)
+
+    pcs_races = [race_resources(race, dpaths[race])['_pcs_race']
+                 for race in races]
+    fetch_resources(pcs_races, update=update, pool=pool, timings=fetched)
+
+    resources = []
+    for race in races:
+        pcs_race_res = race_resources(race, dpaths[race])['_pcs_race']
+
+        # not trying again if it just failed
+        if not store.exists(pcs_race_res['fpath']):
+            errors[race] = 'no pcs race data'
+            continue
+
+        pcs_race = get_resource(**pcs_race_res)
+
+        race_start = get_race_start(pcs_race)
+
+        resources.extend(
+            res for attr, res in
+            race_resources(race, dpaths[race], race_start).items()
+            if attr != '_pcs_race')
+
+        for i, _ in enumerate(pcs_race['stages']):
+            resources.extend(stage_resources(race, i + 1, dpaths[race],
+                                             race_start).values())
+
+    fetch_resources(resources, update=update, pool=pool, timings=fetched)
+
+    for x in fetched:
+        race = race_of(x['fpath'], dpaths)
+        timings[race]['fetched'] += 1
+        timings[race]['fetch_s'] += x['secs']
+
+
+def build_all(races, timings, errors):
+    """
+    Make the Race objects, all resources now being cached
+    """
+    out = []
+
+    for race in races:
+        start = time.perf_counter()
+        try:
+            out.append(Race(race, prefetch=False))
+        except Exception as e:
+            LOG.info(f'cannot build {race}: {e!r}')
+            errors[race] = repr(e)
+            continue
+        timings[race]['build_s'] = time.perf_counter() - start
+        timings[race]['stages'] = len(out[-1].stages)
+
+    return out
+
+
+def download_all(races, pool, timings):
+    """
+    Download the images needed for the roadbooks of all the races
+    """
+    dpaths = {race._race: race.dpath for race in races}
+
+    imgs = []
+    for race in races:
+        imgs.extend(race.all_imgs(others=False))
+
+    for x in download_images(imgs, pool=pool):
+        race = race_of(x['fpath'], dpaths)
+        timings[race]['imgs'] += 1
+        timings[race]['imgs_s'] += x['secs']
+
+
+def render_all(races, km_to_go, incremental, max_workers, timings, errors):
+    """
+    Draw the roadbooks, a race per worker process
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {race._race: pool.submit(render_roadbook, race,
+                                           km_to_go, incremental)
+                   for race in races}
+
+        for race, future in futures.items():
+            try:
+                timings[race]['render_s'] = future.result()
+            except Exception as e:
+                LOG.info(f'cannot draw {race}: {e!r}')
+                errors[race] = repr(e)
+
+
+def render_roadbook(race, km_to_go, incremental):
+    """
+    Runs in the worker.  Returns the secs taken
+    """
+    from .drawing.roadbook import print_roadbook
+
+    start = time.perf_counter()
+    print_roadbook(race, km_to_go=km_to_go, incremental=incremental)
+
+    return time.perf_counter() - start
+
+
+def race_of(fpath, dpaths):
+    """
+    Which of the races (dict of race: dpath) the file at fpath is for
+    """
+    for race, dpath in dpaths.items():
+        if dpath in fpath.parents:
+            return race
+
+
+def make_summary(timings, errors):
+    df = pd.DataFrame.from_dict(
+        {race: dict(x) for race, x in timings.items()}, orient='index')
+
+    cols = ['stages', 'fetched', 'fetch_s', 'build_s', 'imgs', 'imgs_s',
+            'render_s']
+    df = df.reindex(columns=cols).fillna(0)
+
+    for col in ['stages', 'fetched', 'imgs']:
+        df[col] = df[col].astype(int)
+
+    df['error'] = pd.Series(errors, dtype=object)
+    df['error'] = df['error'].fillna('')
+    df.index.name = 'race'
+
+    return df.round(2)
@@ -0,0 +1,131 @@
+"""
+A content-addressed store for downloaded files (ie images), shared by all
+races, so the same cdn image is only ever downloaded and stored once.
+
+Layout under BLOB_DIR:
+    objects/ab/abcdef...jpg  : the bytes, named by their sha256
+    urls/0123...             : one small file per url (named by sha1 of
+                               the url), holding the object name
+
+The files in stage and race dirs are hardlinks to the objects (or copies,
+if the filesystem won't link), so existing paths all still work.
+
+>>> blob = lookup(url)  # None if never downloaded
+>>> blob = add(tmp_fpath, url)  # move a downloaded file into the store
+>>> link(blob, stage_dpath / 'profile.jpg')
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+from .constants import DATA_DIR, LOG
+
+BLOB_DIR = DATA_DIR / '.blobs'
+
+
+def url_key(url):
+    """
+    pcs urls turn up with both http and https, so treat them the same
+    """
+    url = url.replace("http://", "https://")
+
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def file_hash(fpath):
+    h = hashlib.sha256()
+
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def object_fpath(name):
+    return BLOB_DIR / 'objects' / name[:2] / name
+
+
+def lookup(url):
+    """
+    Return the path of the stored object for the url, or None
+    """
+    url_fp = BLOB_DIR / 'urls' / url_key(url)
+
+    if not url_fp.exists():
+        return None
+
+    blob = object_fpath(url_fp.read_text().strip())
+
+    if not blob.exists():
+        return None
+
+    return blob
+
+
+def temp_fpath(suffix=''):
+    """
+    A fresh path in the store to download to, then pass to add()
+    (same filesystem, so the move is a rename)
+    """
+    tmp_dir = BLOB_DIR / 'tmp'
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    return tmp_dir / f"{uuid.uuid4().hex}{suffix}"
+
+
+def add(fpath, url=None, f_ext=None):
+    """
+    Move the file at fpath into the store and return the object path.
+    If the same bytes are already stored, fpath is just deleted.
+    Records the url against the object, if passed
+    """
+    if f_ext is None:
+        f_ext = fpath.suffix.lstrip('.') or 'bin'
+
+    name = f"{file_hash(fpath)}.{f_ext}"
+    blob = object_fpath(name)
+
+    if blob.exists():
+        fpath.unlink()
+        # mark as freshly fetched, for the cache policy
+        os.utime(blob)
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(fpath, blob)
+
+    if url is not None:
+        url_fp = BLOB_DIR / 'urls' / url_key(url)
+        url_fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = temp_fpath()
+        tmp.write_text(name)
+        os.replace(tmp, url_fp)
+
+    return blob
+
+
+def link(blob, fpath):
+    """
+    Put the object at fpath, replacing anything there
+    """
+    tmp = fpath.parent / f".{fpath.name}.{uuid.uuid4().hex}.tmp"
+
+    try:
+        os.link(blob, tmp)
+    except OSError:
+        shutil.copy2(blob, tmp)
+
+    os.replace(tmp, fpath)
+
+
+def disk_usage():
+    """
+    Return number of objects and total bytes in the store
+    """
+    objs = [x for x in (BLOB_DIR / 'objects').glob('*/*') if x.is_file()]
+    total = sum(x.stat().st_size for x in objs)
+
+    LOG.info(f'blob store: {len(objs)} objects, {total / 1e6:.1f}MB')
+
+    return len(objs), total
@@ -0,0 +1,122 @@
+"""
+How long cached resources stay fresh.
+
+Each parser (see get_resources.py) has a ttl for each phase of the race:
+    'early'     : more than RACE_WEEK before the start
+    'race_week' : the week before the start
+    'racing'    : from the start on
+
+A ttl of None means the resource never goes stale in that phase - eg
+html and imgs are taken as fixed once the race starts.
+
+Parsers not listed here never go stale, and nor does anything if the race
+start isn't known yet.  Race.update() still forces a refetch of everything.
+"""
+from datetime import datetime, timedelta
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+WEEK = timedelta(weeks=1)
+
+RACE_WEEK = timedelta(days=7)
+
+CACHE_POLICIES = {
+    # cs and pcs pages
+    'html':                 {'early': WEEK, 'race_week': DAY, 'racing': None},
+    'cs_race_data':         {'early': WEEK, 'race_week': DAY, 'racing': None},
+    'pcs_profile_img_urls': {'early': WEEK, 'race_week': DAY, 'racing': None},
+    'pcs_route_img_url':    {'early': WEEK, 'race_week': DAY, 'racing': None},
+    'pcs_stage_img_urls':   {'early': WEEK, 'race_week': DAY, 'racing': None},
+    # pcs api - stage data includes the climbs
+    'pcs_race_api':         {'early': WEEK, 'race_week': DAY, 'racing': DAY},
+    'pcs_race_climbs_api':  {'early': WEEK, 'race_week': DAY, 'racing': DAY},
+    'pcs_stage_api':        {'early': WEEK, 'race_week': DAY, 'racing': DAY},
+    'pcs_startlist':        {'early': DAY, 'race_week': HOUR, 'racing': HOUR},
+    # only cached once the stage's gc is up - refetched while pcs may
+    # still correct it by get_gc.results_stale(), as that goes by the
+    # stage's finish rather than the race phase
+    'pcs_stage_results':    {'early': None, 'race_week': None, 'racing': None},
+    # image files
+    'image':                {'early': WEEK, 'race_week': DAY, 'racing': None},
+}
+
+
+def get_race_start(pcs_race):
+    """
+    Return the start date from the pcs race data, or None
+    """
+    if not pcs_race or not pcs_race.get('startdate'):
+        return None
+
+    return datetime.strptime(pcs_race['startdate'], "%Y-%m-%d").date()
+
+
+def get_phase(race_start, now=None):
+    """
+    Return 'early', 'race_week' or 'racing' for the passed start date
+    """
+    if now is None:
+        now = datetime.now()
+
+    today = now.date() if isinstance(now, datetime) else now
+
+    if today >= race_start:
+        return 'racing'
+
+    if today >= race_start - RACE_WEEK:
+        return 'race_week'
+
+    return 'early'
+
+
+def get_phase_end(race_start, now=None):
+    """
+    Return the date the current phase ends (so ttls change), or None
+    once racing
+    """
+    phase = get_phase(race_start, now)
+
+    if phase == 'early':
+        return race_start - RACE_WEEK
+
+    if phase == 'race_week':
+        return race_start
+
+    return None
+
+
+def get_ttl(parser, race_start, now=None):
+    """
+    Return the ttl (a timedelta, or None for never stale) for the parser
+    """
+    if race_start is None or parser not in CACHE_POLICIES:
+        return None
+
+    return CACHE_POLICIES[parser][get_phase(race_start, now)]
+
+
+def is_stale(fetched, parser, race_start, now=None):
+    """
+    Has a resource fetched at the passed datetime gone stale?
+    """
+    if now is None:
+        now = datetime.now()
+
+    ttl = get_ttl(parser, race_start, now)
+
+    if ttl is None:
+        return False
+
+    return now - fetched >= ttl
+
+
+def get_expiry(fetched, parser, race_start):
+    """
+    When a resource fetched now will go stale, as an isoformat str, or None
+    """
+    ttl = get_ttl(parser, race_start, fetched)
+
+    if ttl is None:
+        return None
+
+    return (fetched + ttl).isoformat()
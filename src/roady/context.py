@@ -0,0 +1,121 @@
+"""
+The race-level things a Stage needs: the race start, the race's parsed
+pcs resources, the image index and the http session.
+
+Race makes one and hands it to each of its stages, so a whole build reads
+each race-level file once.  A Stage made on its own gets one that loads
+from the race dir on first use.
+"""
+import pandas as pd
+
+from . import session
+from . import store
+from .cache_policy import get_race_start
+from .img_index import ImageIndex
+from .serial import read_json
+
+
+class RaceContext:
+
+    def __init__(self, race, dpath, race_start=None,
+                 pcs_profile_img_urls=None, race_climbs=None,
+                 img_index=None):
+        """
+        Pass whatever is already in memory, the rest is loaded from the
+        race dir at dpath when first asked for
+        """
+        self.race = race
+        self.dpath = dpath
+
+        # use the race's single-file store if it has one, see store.py
+        store.open_store(dpath)
+
+        self._race_start = race_start
+        self._pcs_profile_img_urls = pcs_profile_img_urls
+        self._race_climbs = race_climbs
+
+        # what has been worked out, as None can be the real value, eg no
+        # start date yet (a set rather than a sentinel so it pickles)
+        self._loaded = {name for name, value in [
+            ('race_start', race_start),
+            ('pcs_profile_img_urls', pcs_profile_img_urls),
+            ('race_climbs', race_climbs)] if value is not None}
+
+        if img_index is None:
+            img_index = ImageIndex(dpath)
+        self.img_index = img_index
+
+    @property
+    def session(self):
+        return session.get_session()
+
+    @property
+    def race_start(self):
+        if 'race_start' not in self._loaded:
+            self._race_start = get_race_start(self._read('.pcs_race.json'))
+            self._loaded.add('race_start')
+        return self._race_start
+
+    @race_start.setter
+    def race_start(self, value):
+        self._race_start = value
+        self._loaded.add('race_start')
+
+    @property
+    def pcs_profile_img_urls(self):
+        if 'pcs_profile_img_urls' not in self._loaded:
+            self._pcs_profile_img_urls = self._read(
+                '.pcs_profile_img_urls.json')
+            self._loaded.add('pcs_profile_img_urls')
+        return self._pcs_profile_img_urls
+
+    @pcs_profile_img_urls.setter
+    def pcs_profile_img_urls(self, value):
+        self._pcs_profile_img_urls = value
+        self._loaded.add('pcs_profile_img_urls')
+
+    @property
+    def race_climbs(self):
+        """
+        The detailed race climbs as a df indexed by url
+        """
+        if 'race_climbs' not in self._loaded:
+            self._race_climbs = make_race_climbs_df(
+                self._read('.pcs_race_climbs.json'))
+            self._loaded.add('race_climbs')
+        return self._race_climbs
+
+    @race_climbs.setter
+    def race_climbs(self, value):
+        self._race_climbs = value
+        self._loaded.add('race_climbs')
+
+    def _read(self, fname):
+        fpath = self.dpath / fname
+
+        if not store.exists(fpath):
+            print('cannot find', fpath)
+            return None
+
+        return read_json(fpath)
+
+    def __repr__(self):
+        return f"RaceContext('{self.race}')"
+
+
+def make_race_climbs_df(race_climbs):
+    """
+    The detailed race climbs (from .pcs_race_climbs.json) as a df indexed
+    by climb url, for joining the stage climbs to
+    """
+    df = pd.DataFrame(race_climbs or [])
+
+    if df.empty:
+        return pd.DataFrame(
+            columns=['name', 'length_km', 'perc', 'alt_m', 'km_to_go'],
+            index=pd.Index([], name='url'))
+
+    df.columns = ['name', 'url', 'length_km',
+                  'perc', 'alt_m', 'km_to_go']
+
+    return df.set_index('url')
@@ -0,0 +1,81 @@
+"""
+Downsampled, recompressed versions of images for putting in pdfs.
+
+The cs / pcs images are often much bigger than needed for the space they
+are drawn in, and reportlab embeds whatever it is given.  So make a
+version at DPI for the drawn size, once, and keep it in the blob store
+keyed by the original's content hash and the pixel size:
+
+>>> derived = get_derivative(img_fp, width_cm=19, height_cm=8)
+
+jpgs are saved at JPEG_QUALITY, pngs as palette images with PNG_COLOURS.
+"""
+import os
+
+from .blobs import BLOB_DIR, file_hash, temp_fpath
+from .constants import LOG
+
+DPI = 200
+JPEG_QUALITY = 85
+PNG_COLOURS = 256
+
+DERIVED_DIR = BLOB_DIR / 'derived'
+
+
+def get_derivative(fpath, width_cm, height_cm, dpi=DPI,
+                   quality=JPEG_QUALITY, content_hash=None):
+    """
+    Return the path to a version of the image at fpath sized for drawing
+    at width_cm x height_cm, making it if required.
+    Images are never scaled up, just recompressed.
+    Pass the content_hash if known (eg from the ImageIndex) to save
+    reading the file
+    """
+    px_w = max(1, round(width_cm / 2.54 * dpi))
+    px_h = max(1, round(height_cm / 2.54 * dpi))
+
+    if content_hash is None:
+        content_hash = file_hash(fpath)
+
+    is_png = fpath.suffix.lower() == '.png'
+    f_ext = 'png' if is_png else 'jpg'
+    settings = f"p{PNG_COLOURS}" if is_png else f"q{quality}"
+
+    out = DERIVED_DIR / f"{content_hash}_{px_w}x{px_h}_{settings}.{f_ext}"
+
+    if out.exists():
+        return out
+
+    from PIL import Image as PILImage
+
+    with PILImage.open(fpath) as img:
+        img = flatten(img)
+        img.thumbnail((px_w, px_h), PILImage.LANCZOS)
+
+        tmp = temp_fpath(f".{f_ext}")
+        if is_png:
+            img.quantize(colors=PNG_COLOURS).save(tmp, 'PNG', optimize=True)
+        else:
+            img.save(tmp, 'JPEG', quality=quality, optimize=True)
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp, out)
+
+    LOG.info(f'made {out.name} from {fpath.name}')
+
+    return out
+
+
+def flatten(img):
+    """
+    Return an RGB version of img, with any transparency on white
+    """
+    from PIL import Image as PILImage
+
+    if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        bg = PILImage.new('RGB', img.size, 'white')
+        bg.paste(img, mask=img.getchannel('A'))
+        return bg
+
+    return img.convert('RGB')
@@ -1,4 +1,8 @@
 from pathlib import Path
+from io import BytesIO
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from datetime import datetime
 from reportlab.pdfgen.canvas import Canvas
@@ -9,19 +13,58 @@ from .stage import make_stage_page
 from ..Image import draw_img
 from .teams import make_teams_page
 from .layouts import PORTRAIT
+from .. import derivatives
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader, PdfWriter = None, None
 
 MAX_ROUTE_H = 12
 
+# rendered pages are cached here (in the race dir) by a hash of their inputs
+PAGE_CACHE_DIR = '.pages'
+
+# the code that draws pages - part of every page's inputs, so any change
+# to the layout means a full redraw
+LAYOUT_SOURCES = [
+    Path(__file__).parent / x for x in
+    ['roadbook.py', 'stage.py', 'teams.py', 'layouts.py', 'Rect.py']
+] + [Path(__file__).parent.parent / 'Image.py']
+
 
-def print_roadbook(race, fpath=None, km_to_go=False):
+def print_roadbook(race, fpath=None, km_to_go=False,
+                   parallel=False, incremental=False, max_workers=None):
     """
     Draw front page
     Draw each stage
     Draw teams
+
+    Pass parallel=True to render each page to its own pdf on a process
+    pool and merge them in order (needs pypdf)
+
+    Pass incremental=True to only render pages whose inputs have changed
+    since the last build, reusing the rest from the page cache (also
+    needs pypdf)
     """
     if fpath == None:
         fpath = race.dpath / 'roadbook.pdf'
 
+    if (parallel or incremental) and PdfWriter is None:
+        print('pypdf not installed, drawing all pages in series')
+
+    elif incremental:
+        pages = get_cached_pages(race, get_page_jobs(race), km_to_go,
+                                 parallel, max_workers)
+        merge_pdfs(pages, fpath)
+        return
+
+    elif parallel:
+        pages = render_pages_parallel(race, get_page_jobs(race),
+                                      km_to_go, max_workers)
+        merge_pdfs(pages, fpath)
+        return
+
     can = Canvas(fpath.as_posix())
 
     make_front_page(race, can)
@@ -36,6 +79,175 @@ def print_roadbook(race, fpath=None, km_to_go=False):
     can.save()
 
 
+def get_page_jobs(race):
+    """
+    The pages of the roadbook in order, as ('front' | 'stage' | 'teams',
+    stage index) tuples
+    """
+    return ([('front', None)]
+            + [('stage', i) for i, _ in enumerate(race.stages)]
+            + [('teams', None)])
+
+
+# the race for each worker process, so it is only pickled once per worker
+_WORKER_RACE = None
+
+
+def _init_worker(race):
+    global _WORKER_RACE
+    _WORKER_RACE = race
+
+
+def _render_page_job(args):
+    job, km_to_go = args
+    return render_page(_WORKER_RACE, job, km_to_go)
+
+
+def render_page(race, job, km_to_go=False):
+    """
+    Render a single page (see get_page_jobs) to pdf bytes
+    """
+    kind, ind = job
+    buffer = BytesIO()
+    can = Canvas(buffer)
+
+    if kind == 'front':
+        make_front_page(race, can)
+
+    elif kind == 'stage':
+        st = race.stages[ind]
+        profile_margins = race._cal_df.iloc[st._stage_ind].values
+        make_stage_page(st, canvas=can, km_to_go=km_to_go,
+                        profile_margins=profile_margins)
+
+    elif kind == 'teams':
+        make_teams_page(race.teams, canvas=can)
+
+    can.save()
+
+    return buffer.getvalue()
+
+
+def render_pages_parallel(race, jobs, km_to_go=False, max_workers=None):
+    """
+    Render the page jobs on a process pool, returning pdf bytes in order
+    """
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(race,)) as pool:
+        return list(pool.map(_render_page_job,
+                             [(job, km_to_go) for job in jobs]))
+
+
+def get_cached_pages(race, jobs, km_to_go=False, parallel=False,
+                     max_workers=None):
+    """
+    Return pdf bytes for the page jobs, rendering only those not already
+    in the page cache under the hash of their inputs (see page_inputs).
+    Pages no longer used are cleared out of the cache
+    """
+    cache_dir = race.dpath / PAGE_CACHE_DIR
+    cache_dir.mkdir(exist_ok=True)
+
+    layout = layout_inputs(km_to_go)
+    keys = [page_key(page_inputs(race, job), layout) for job in jobs]
+    fpaths = [cache_dir / f"{key}.pdf" for key in keys]
+
+    todo = [(job, fp) for job, fp in zip(jobs, fpaths) if not fp.exists()]
+    print(f'rendering {len(todo)} of {len(jobs)} pages')
+
+    if parallel:
+        pages = render_pages_parallel(race, [x[0] for x in todo],
+                                      km_to_go, max_workers)
+    else:
+        pages = [render_page(race, job, km_to_go) for job, _ in todo]
+
+    for (_, fp), pdf in zip(todo, pages):
+        fp.write_bytes(pdf)
+
+    for fp in cache_dir.glob('*.pdf'):
+        if fp not in fpaths:
+            fp.unlink()
+
+    return [fp.read_bytes() for fp in fpaths]
+
+
+def page_inputs(race, job):
+    """
+    Everything that goes into drawing a page, in json-able form
+    """
+    kind, ind = job
+
+    if kind == 'front':
+        return {
+            'race': race._race,
+            'df': race.df().to_json(default_handler=str),
+            'route_img': img_hash(race.pcs_route_img),
+        }
+
+    if kind == 'stage':
+        st = race.stages[ind]
+        imgs = st.imgs()
+        return {
+            'stage_no': st.stage_no,
+            'data': st.data,
+            'climbs': st.climbs_df.to_json(),
+            'imgs': {f"{source}_{tag}": img_hash(imgs[source][tag])
+                     for source in ['pcs', 'cs']
+                     for tag in ['profile', 'route']},
+            'calibration': race._cal_df.iloc[st._stage_ind].tolist(),
+        }
+
+    if kind == 'teams':
+        return {'teams': race.teams}
+
+
+def layout_inputs(km_to_go=False):
+    """
+    The inputs common to all pages: drawing options and code
+    """
+    h = hashlib.sha256()
+    for fp in LAYOUT_SOURCES:
+        h.update(fp.read_bytes())
+
+    return {
+        'km_to_go': km_to_go,
+        'portrait': PORTRAIT.dims,
+        'max_route_h': MAX_ROUTE_H,
+        'derivatives': [derivatives.DPI, derivatives.JPEG_QUALITY,
+                        derivatives.PNG_COLOURS],
+        'code': h.hexdigest(),
+    }
+
+
+def page_key(inputs, layout):
+    data = json.dumps([inputs, layout], sort_keys=True, default=str)
+
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def img_hash(img):
+    if img is None or img.url is None or not img.fpath.exists():
+        return None
+
+    return img.content_hash
+
+
+def merge_pdfs(pdfs, fpath):
+    """
+    Write the passed pdfs (as bytes) to a single pdf at fpath, in order
+    """
+    writer = PdfWriter()
+
+    for pdf in pdfs:
+        writer.append(PdfReader(BytesIO(pdf)))
+
+    with open(fpath, 'wb') as fp:
+        writer.write(fp)
+
+    print('saved roadbook to', fpath)
+
+
 def make_front_page(race, canvas=None, fp_out=None, no_map=False):
     """
     List of stages and map
@@ -60,7 +272,7 @@ def make_front_page(race, canvas=None, fp_out=None, no_map=False):
     route_rect = rect.new(top=rect.top - title_h)
     route_rect.height = MAX_ROUTE_H
 
-    actual = draw_img(race.pcs_route_img.fpath, route_rect, canvas=can)
+    actual = draw_img(race.pcs_route_img, route_rect, canvas=can)
 
     # STAGES
     # titles with df cols and relative widths
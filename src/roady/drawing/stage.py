@@ -25,11 +25,11 @@ def make_stage_page(stage, canvas=None, fp=None, gc=False,
     # PROFILE
     imgs = stage.imgs()
     if imgs['pcs']['profile'] is not None:
-        img_fp = imgs['pcs']['profile'].fpath
+        img_fp = imgs['pcs']['profile']
     elif imgs['cs']['profile'] is not None:
-        img_fp = imgs['cs']['profile'].fpath
+        img_fp = imgs['cs']['profile']
     else:
-        img_fp is None
+        img_fp = None
 
     if img_fp is not None:
         used['profile'] = draw_img(
@@ -67,7 +67,7 @@ def make_stage_page(stage, canvas=None, fp=None, gc=False,
                         from_bottom=True)
             route_tall = True
         
-        used['route'] = draw_img(img_fp=img.fpath, canvas=can, rect=rect)
+        used['route'] = draw_img(img_fp=img, canvas=can, rect=rect)
 
     else:
         can.setFont('Helvetica-Bold', 18)
@@ -24,3 +24,11 @@ while
 
 class DownloadError(Exception):
     pass
+
+
+class NotModified(Exception):
+    """
+    Raised by a conditional request when the server says the resource
+    hasn't changed (304), so the cached copy stands
+    """
+    pass
@@ -1,20 +1,36 @@
-from procyclingstats import Stage, Team
+import re
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
-
-from .constants import DATA_DIR
-from .get_teams import sanitize_team, sanitize_rider
-
-PCS_TOURS = {
-    'giro': 'giro-d-italia',
-    'tour': 'tour-de-france',
-    'vuelta': 'vuelta-a-espana',
-    'dauphine': 'dauphine',
-}
+# NB procyclingstats and the reportlab Canvas are imported where used
+
+from .constants import DATA_DIR, LOG
+from .names import TEAMS, RIDERS
+from .urls import make_pcs_url
+from .get_resources import get_resource, fetch_resources, get_fetched
+from . import serial
+from . import store
+
+# for update_tour_gcs: when to start looking for a stage's gc, after its
+# start time (or DEFAULT_START if pcs doesn't have one)
+GC_AFTER = timedelta(hours=4, minutes=30)
+DEFAULT_START = '12:00'
+# secs between polls, doubling up to POLL_MAX
+POLL_MIN = 5 * 60
+POLL_MAX = 60 * 60
+# for parse_times / format_times
+TIME_RE = re.compile(r'^(\d+:)?\d{1,2}:\d{2}$')
+TWO_DIGITS = np.array([str(x).zfill(2) for x in range(100)], dtype=object)
+# give up on a stage if there's still no gc this long after it should be up
+GIVE_UP_AFTER = timedelta(hours=24)
+# pcs often corrects a gc after first posting it (penalties, relegations)
+# so stage results are refetched after RESULTS_TTL, until fetched at
+# least RESULTS_FINAL_AFTER the stage should have finished, then final
+RESULTS_TTL = timedelta(hours=1)
+RESULTS_FINAL_AFTER = timedelta(days=2)
 
 
 def print_stage_gc(stage_no, race='dauphine_2025', df=None):
@@ -33,6 +49,8 @@ def print_stage_gc(stage_no, race='dauphine_2025', df=None):
         else:
             df = get_stage_gc(stage_no, race)
 
+    from reportlab.pdfgen.canvas import Canvas
+
     can = Canvas(pdf_fp.as_posix())
 
     can.setFont('Helvetica-Bold', 18)
@@ -61,9 +79,12 @@ def print_stage_gc(stage_no, race='dauphine_2025', df=None):
 
 
 def get_stage_gc(stage_no, race='dauphine_2025',
-                 return_df=True):
+                 return_df=True, update=False):
     """
-    Gets the gc BEFORE the pased stage and saves as csv
+    Gets the gc BEFORE the pased stage and saves as csv.
+    The pcs page is cached once it has the gc, and refetched while pcs
+    may still correct it (see results_stale()) - pass update=True to
+    get any corrections now
     """
     stage_no = int(stage_no)
 
@@ -71,27 +92,181 @@ def get_stage_gc(stage_no, race='dauphine_2025',
         print('no gc before stage 1')
         return
 
-    name, edition = race.split('_')
-    pcs_tour = PCS_TOURS[name]
+    race_dir = DATA_DIR / race
+    store.open_store(race_dir)
 
-    stage = Stage(f'race/{pcs_tour}/{edition}/stage-{stage_no-1}')
-    race_dir = DATA_DIR / f"{name}_{edition}"
+    # the stage before's results page has the gc
+    due = get_cached_stage_finish(race, stage_no - 1)
+    update = update or results_stale(race, stage_no - 1, due)
+    data = get_resource(**results_resource(race, stage_no - 1,
+                                           update=update))
 
-    gc_dict = stage.gc()
-
-    if not gc_dict:
+    if not data:
         print('no gc found - presumably dont exist yet')
         return
 
+    gc_dict = data['gc']
+
     if not return_df:
         return gc_dict
 
+    df = make_gc_df(gc_dict)
+
+    stage_dir = race_dir / f'stage_{stage_no}'
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    fp = stage_dir / 'gc.csv'
+
+    print('printing to', fp)
+    df.to_csv(fp)
+
+    return df
+
+def update_tour_gcs(name, year):
+    """
+    Keep the gc pdfs for the whole race current, eg update_tour_gcs('tour',
+    2025).  Runs until every stage has its starting gc.
+
+    The stage dates and start times are in the cached pcs stage data, so
+    this sleeps until a stage should have finished, then polls pcs (with
+    backoff) until its gc is up, and writes gc.csv and gc.pdf for the next
+    stage.  Stages that already have a gc.csv are final and are skipped,
+    so each finished stage costs one fetch (or a few if pcs is slow).
+
+    NB times are compared to the local clock, not the race's
+    """
+    race = f"{name}_{year}"
+
+    for stage_no, due in get_gc_times(race):
+        csv_fp = DATA_DIR / race / f'stage_{stage_no}' / 'gc.csv'
+
+        if csv_fp.exists():
+            continue
+
+        wait = (due - datetime.now()).total_seconds()
+        if wait > 0:
+            print(f'waiting until {due:%a %d %b %H:%M} for stage '
+                  f'{stage_no - 1} results')
+            time.sleep(wait)
+
+        df = poll_stage_gc(stage_no, race, due + GIVE_UP_AFTER)
+
+        if df is None:
+            print(f'giving up on the gc for stage {stage_no}')
+            continue
+
+        print_stage_gc(stage_no, race, df)
+
+    print(f'all gcs done for {race}')
+
+
+def get_gc_times(race):
+    """
+    List of (stage_no, when its starting gc should be up) for the race,
+    from stage 2 on
+    """
+    finishes = get_stage_finishes(race)
+
+    return [(stage_no + 1, due) for stage_no, due in finishes.items()
+            if due is not None and stage_no + 1 in finishes]
+
+
+def get_stage_finishes(race):
+    """
+    Dict of stage_no: when its results should be up, using the cached
+    pcs race and stage data (fetching any that is missing).  None for
+    stages with no date
+    """
+    from .Race import race_resources
+    from .Stage import stage_resources
+    from .cache_policy import get_race_start
+
+    dpath = DATA_DIR / race
+    store.open_store(dpath)
+
+    pcs_race = get_resource(**race_resources(race, dpath)['_pcs_race'])
+    if not pcs_race:
+        raise ValueError(f'cannot get the pcs race data for {race}')
+
+    race_start = get_race_start(pcs_race)
+    stage_nos = range(1, len(pcs_race['stages']) + 1)
+
+    resources = [stage_resources(race, i, dpath, race_start)['_pcs_data']
+                 for i in stage_nos]
+    fetch_resources(resources)
+
+    out = {}
+    for stage_no, res in zip(stage_nos, resources):
+        out[stage_no] = get_stage_finish(get_resource(**res))
+        if out[stage_no] is None:
+            LOG.info(f'no date for stage {stage_no}')
+
+    return out
+
+
+def get_stage_finish(pcs_data):
+    """
+    When the stage's gc should be up, from the date and start_time in
+    its pcs data, or None if there's no date
+    """
+    if not pcs_data or not pcs_data.get('date'):
+        return None
+
+    # pcs start times are eg '13:10', or with the zone after it
+    match = re.search(r'(\d{1,2}):(\d{2})',
+                      pcs_data.get('start_time') or '')
+    start = match.group(0) if match else DEFAULT_START
+
+    start = datetime.strptime(f"{pcs_data['date']} {start}",
+                              "%Y-%m-%d %H:%M")
+
+    return start + GC_AFTER
+
+
+def poll_stage_gc(stage_no, race, give_up):
+    """
+    get_stage_gc() until there is one, waiting longer between each try.
+    Returns None if there's still no gc at give_up (a datetime).
+
+    NB a failed fetch just gives no gc (get_resource catches it), so
+    anything raised here is a bug and isn't retried
+    """
+    wait = POLL_MIN
+
+    while True:
+        df = get_stage_gc(stage_no, race)
+
+        if df is not None:
+            return df
+
+        if datetime.now() + timedelta(seconds=wait) > give_up:
+            return None
+
+        print(f'no gc yet for stage {stage_no}, trying again in '
+              f'{wait // 60} mins')
+        time.sleep(wait)
+        wait = min(wait * 2, POLL_MAX)
+
+
+def make_gc_df(gc_dict):
+    """
+    The gc df for printing from the pcs stage.gc() list of rider dicts,
+    indexed by pos, with the gaps to the leader
+    """
     df = pd.DataFrame(gc_dict)
+    df['time_s'] = parse_times(df['time'])
+
+    return format_gc(df)
+
 
-    df['time_s'] = df['time'].apply(get_secs)
-    df['gap_s'] = df['time_s'] - df.loc[0, 'time_s']
-    df['gap'] = df['gap_s'].apply(get_time_str)
-    df['bonus_s'] = df['bonus'].apply(get_secs)
+def format_gc(df):
+    """
+    The gc for printing from a df of riders in gc order, with their
+    rider_name, team_name and total time_s
+    """
+    df = df.reset_index(drop=True)
+
+    df['gap_s'] = df['time_s'] - df['time_s'].iloc[0]
+    df['gap'] = format_times(df['gap_s'])
 
     df.index += 1
     df.index.name = 'pos'
@@ -101,27 +276,291 @@ def get_stage_gc(stage_no, race='dauphine_2025',
     # df['team_abbr'] = df['team_name'].apply(
     #     lambda x: teams.loc[x, 'abbreviation'])
 
-    df['team_name'] = df['team_name'].apply(sanitize_team)
+    df['team_name'] = TEAMS.map(df['team_name'])
     # df['team_name'] = df['team_name'].str.replace('Israel', 'Genocidal')
     # df['team_abbr'] = df['team_abbr'].str.replace('IPT', 'GPT')
 
     df = df[[
         'rider_name', 'team_name',
         # 'team_abbr',
-        # 'rider_number', 'team_name', 'time', 'bonus_s',
+        # 'rider_number', 'team_name', 'time', 'bonus',
         'gap',
     ]]
 
-    df['rider_name'] = df['rider_name'].apply(sanitize_rider)
+    df['rider_name'] = RIDERS.map(df['rider_name'])
 
-    stage_dir = race_dir / f'stage_{stage_no}'
-    fp = stage_dir / 'gc.csv'
+    return df
+
+
+# GC FROM THE STAGE RESULTS
+def results_resource(race, stage_no, update=False):
+    """
+    The pcs results (and gc) for a stage, as get_resource() kwargs.
+    update=True to refetch just this stage's
+    """
+    return dict(
+        url=make_pcs_url(race, 'stage', stage_no),
+        fpath=DATA_DIR / race / f'stage_{stage_no}' / '.pcs_results.json',
+        parser='pcs_stage_results',
+        update=update,
+    )
 
-    print('printing to', fp)
-    df.to_csv(fp)
+
+def results_stale(race, stage_no, due, now=None):
+    """
+    Should the cached results for the stage be refetched, as pcs may
+    have corrected them since?  due is when the stage should have
+    finished (see get_stage_finish()), or None if not known
+    """
+    fpath = results_resource(race, stage_no)['fpath']
+
+    if due is None or not store.exists(fpath):
+        return False
+
+    if now is None:
+        now = datetime.now()
+
+    fetched = get_fetched(fpath)
+
+    return (fetched < due + RESULTS_FINAL_AFTER
+            and now - fetched > RESULTS_TTL)
+
+
+def get_cached_stage_finish(race, stage_no):
+    """
+    get_stage_finish() from the stage's cached pcs data, or None
+    """
+    fpath = DATA_DIR / race / f'stage_{stage_no}' / '.pcs_data.json'
+
+    if not store.exists(fpath):
+        return None
+
+    return get_stage_finish(serial.read_json(fpath))
+
+
+def fetch_stage_results(race, update=False):
+    """
+    Fill the results caches for all the race's stages that should have
+    finished, and refetch those pcs may have corrected since (see
+    results_stale()).  Pass update=True to refetch them all
+    """
+    now = datetime.now()
+
+    resources = [results_resource(race, stage_no,
+                                  update=results_stale(race, stage_no,
+                                                       due, now))
+                 for stage_no, due in get_stage_finishes(race).items()
+                 if due is not None and due <= now]
+
+    return fetch_resources(resources, update=update)
+
+
+def load_stage_results(race):
+    """
+    The cached results for stage 1 on, up to the first stage without
+    """
+    store.open_store(DATA_DIR / race)
+
+    out = []
+    while True:
+        fpath = results_resource(race, len(out) + 1)['fpath']
+        if not store.exists(fpath):
+            return out
+        out.append(serial.read_json(fpath))
+
+
+def build_gcs(race, fetch=True, update=False, save=True, pdfs=True,
+              check=True):
+    """
+    Work out the gc after every stage from the cached stage results, and
+    save them as the starting gc.csv (and gc.pdf) of the stage after, eg
+    after a sanitize rule has changed:
+    >>> build_gcs('tour_2025', fetch=False)
+
+    Only results missing or gone stale are fetched, and none with
+    fetch=False.
+
+    With check=True, each gc is compared with pcs's own, and a df of
+    the differences per stage returned.  Where they differ (ours knows
+    nothing of time penalties, and gives everyone in a ttt the team
+    time) the pcs gc is saved instead, and the stages listed
+    """
+    if fetch:
+        fetch_stage_results(race, update=update)
+
+    results = load_stage_results(race)
+
+    if not results:
+        print(f'no stage results cached for {race}')
+        return
+
+    gcs = compute_gcs([x['results'] for x in results])
+
+    checks = []
+    for stage_no, (gc, data) in enumerate(zip(gcs, results), start=1):
+        df = format_gc(gc)
+
+        if check:
+            checked = check_gc(gc, data['gc'])
+            checked['used'] = 'ours'
+            if gc_differs(checked):
+                checked['used'] = 'pcs'
+                df = make_gc_df(data['gc'])
+            checks.append(dict(stage=stage_no, **checked))
+
+        if not save:
+            continue
+
+        # NB the final gc has no stage after it
+        stage_dir = DATA_DIR / race / f'stage_{stage_no + 1}'
+        if not stage_dir.exists():
+            continue
+
+        df.to_csv(stage_dir / 'gc.csv')
+        if pdfs:
+            print_stage_gc(stage_no + 1, race, df)
+
+    if not check:
+        return
+
+    # NB no counts for stages without a pcs gc
+    df = pd.DataFrame(checks).set_index('stage').convert_dtypes()
+    print(df.to_string())
+
+    differs = df.index[df['used'] == 'pcs'].tolist()
+    if differs:
+        print(f'gc differs from pcs after stages {differs}, '
+              'so used the pcs gc for those')
 
     return df
 
+
+def gc_differs(checked):
+    """
+    Does the check_gc() result show a difference from a pcs gc?
+    """
+    if not checked.get('pcs_riders'):
+        return False
+
+    return any(checked[x] for x in ['not_in_pcs', 'not_in_ours',
+                                    'places_differ', 'max_time_diff_s'])
+
+
+def compute_gcs(results):
+    """
+    The gc after each stage from the list of pcs stage results (lists of
+    rider dicts), stage 1 first.
+
+    A rider's gc time is the sum of their stage times less the sum of
+    their bonuses, for riders that finished every stage so far.  Ties go
+    to the lowest sum of stage places, as the uci rule.
+
+    All stages are done at once, as a riders x stages table of times
+    summed along the stages.  Returns a list of dfs in gc order, with
+    rider_url, rider_name, team_name, time_s and bonus_s
+    """
+    rows = make_results_df([dict(x, stage=i)
+                            for i, stage in enumerate(results, start=1)
+                            for x in stage])
+
+    stages = range(1, len(results) + 1)
+
+    def table(col):
+        return rows.pivot(index='rider_url', columns='stage',
+                          values=col).reindex(columns=stages)
+
+    times = table('time_s')
+    bonuses = table('bonus_s').fillna(0)
+    places = table('rank')
+
+    # out for good after the first stage not finished
+    in_race = times.notna().cummin(axis=1)
+    gc_times = times.cumsum(axis=1) - bonuses.cumsum(axis=1)
+    gc_bonuses = bonuses.cumsum(axis=1)
+    gc_places = places.cumsum(axis=1)
+
+    # the names as of the latest stage each rider was in
+    names = rows.groupby('rider_url')[['rider_name', 'team_name']].last()
+
+    out = []
+    for stage in stages:
+        riders = in_race.index[in_race[stage]]
+
+        gc = pd.DataFrame({
+            'time_s': gc_times.loc[riders, stage].astype(int),
+            'bonus_s': gc_bonuses.loc[riders, stage].astype(int),
+            'places': gc_places.loc[riders, stage],
+        }).join(names)
+
+        gc = gc.sort_values(['time_s', 'places'], kind='stable')
+        gc.index.name = 'rider_url'
+        out.append(gc.reset_index()[['rider_url', 'rider_name', 'team_name',
+                                     'time_s', 'bonus_s']])
+
+    return out
+
+
+def make_results_df(results):
+    """
+    The finishers in the stage results (rider dicts with their stage),
+    with their time_s, bonus_s and rank.
+    NB ttt results have no status, rank or bonus
+    """
+    df = pd.DataFrame(results)
+
+    df = df.reindex(columns=['stage', 'rider_url', 'rider_name', 'team_name',
+                             'rank', 'status', 'time', 'bonus'])
+    df['status'] = df['status'].fillna('DF')
+    df['rank'] = pd.to_numeric(df['rank'], errors='coerce')
+    df['rank'] = df['rank'].fillna(df.groupby('stage').cumcount() + 1)
+
+    has_time = df['time'].fillna('').astype(str).str.strip() != ''
+    df = df[(df['status'] == 'DF') & has_time].copy()
+
+    df['time_s'] = parse_times(df['time'])
+    df['bonus_s'] = parse_times(df['bonus'], blank=0)
+
+    return df.drop_duplicates(['stage', 'rider_url'])
+
+
+def check_gc(gc, pcs_gc):
+    """
+    Compare a gc from compute_gcs() with the pcs one for the same stage.
+    Returns counts of riders only in one or the other, or in a different
+    place, and the biggest time difference in secs
+    """
+    if not pcs_gc:
+        return {'riders': len(gc), 'pcs_riders': 0}
+
+    pcs = pd.DataFrame(pcs_gc)
+    pcs['pos'] = pd.to_numeric(pcs['rank'], errors='coerce')
+    pcs['time_s'] = parse_times(pcs['time'])
+
+    ours = gc.assign(pos=range(1, len(gc) + 1))
+
+    both = ours.set_index('rider_url')[['pos', 'time_s']].join(
+        pcs.drop_duplicates('rider_url').set_index('rider_url')[
+            ['pos', 'time_s']],
+        how='outer', rsuffix='_pcs')
+
+    matched = both.dropna()
+    time_diffs = (matched['time_s'] - matched['time_s_pcs']).abs()
+
+    out = {
+        'riders': len(gc),
+        'pcs_riders': len(pcs),
+        'not_in_pcs': int(both['pos_pcs'].isna().sum()),
+        'not_in_ours': int(both['pos'].isna().sum()),
+        'places_differ': int((matched['pos'] != matched['pos_pcs']).sum()),
+        'max_time_diff_s': int(time_diffs.max()) if len(matched) else 0,
+    }
+
+    if out['places_differ'] or out['max_time_diff_s']:
+        LOG.info(f'gc differs from pcs: {out}')
+
+    return out
+
+
 def get_teams(team_urls, tour_dir=None):
     """
     Return a df from the list of team urls
@@ -143,6 +582,8 @@ def get_team(team_url):
     """
     For a url return select data
     """
+    from procyclingstats import Team
+
     team = Team(team_url).parse()
 
     return {
@@ -155,12 +596,67 @@ def get_team(team_url):
     }
 
 
+def parse_times(times, blank=None):
+    """
+    get_secs() for a whole series of pcs times at once.  Takes 'H:MM:SS'
+    or 'MM:SS', and ',,' (same time as the rider above) gets the time
+    above.  Blanks get the passed blank value (eg 0 for bonuses), and
+    raise a ValueError if it's None, as does anything else
+
+    Each distinct time is parsed once and the rest is done on the whole
+    series - pandas' own string methods are no quicker than get_secs()
+    for a gc's worth of times
+    """
+    times = times.fillna('').astype(str).str.strip()
+
+    lookup = {x: get_secs(x) for x in times.unique() if TIME_RE.match(x)}
+    secs = times.map(lookup)
+
+    same = times == ',,'
+    is_blank = times == ''
+    if blank is not None:
+        secs[is_blank] = blank
+        is_blank[:] = False
+
+    bad = times[secs.isna() & ~same]
+    if len(bad):
+        raise ValueError(f'cannot parse times {bad.unique().tolist()}')
+
+    # NB only ',,' are missing now
+    secs = secs.ffill()
+    if secs.isna().any():
+        raise ValueError("',,' time with no time above it")
+
+    return secs.astype(int)
+
+
+def format_times(secs):
+    """
+    get_time_str() for a whole series of secs at once
+    """
+    index = getattr(secs, 'index', None)
+    secs = np.asarray(secs, dtype=int)
+
+    if (secs < 0).any():
+        raise ValueError(f'negative times {secs[secs < 0].tolist()}')
+
+    hours = secs // 3600
+
+    mins_secs = TWO_DIGITS[secs % 3600 // 60] + ':' + TWO_DIGITS[secs % 60]
+    hours = np.where(hours < 100, TWO_DIGITS[np.minimum(hours, 99)],
+                     hours.astype(str).astype(object))
+
+    return pd.Series(np.where(hours == '00', mins_secs,
+                              hours + ':' + mins_secs), index=index)
+
+
 def get_secs(time_str):
     """
-    Convert time_str to seconds
+    Convert time_str, "H:MM:SS" or "MM:SS", to seconds
     """
 
-    hours, mins, secs = [int(x) for x in time_str.split(':')]
+    hours, mins, secs = [int(x) for x in
+                         f"0:{time_str}".split(':')[-3:]]
 
     return (hours * 60 * 60) + (mins * 60) + secs
 
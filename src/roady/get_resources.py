@@ -1,48 +1,87 @@
-import requests
-from bs4 import BeautifulSoup
-import json
-import procyclingstats
 import sys
+import time
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .urls import PCS_MAIN
 from .constants import LOG
+from . import session
+from .session import get_host
+from . import store
+from . import serial
+from .errors import NotModified
+from .cache_policy import is_stale, get_expiry, get_ttl
 
 
-def get_resource(url, fpath, parser, update=False):
+# parsers that make a plain http request, so can send validators from
+# the last response and get a 304 back if nothing has changed
+CONDITIONAL_PARSERS = [
+    'cs_race_data', 'html', 'pcs_profile_img_urls', 'pcs_route_img_url',
+    'pcs_stage_img_urls',
+]
+
+
+def get_resource(url, fpath, parser, update=False, race_start=None):
     """
     Base function for returning external resources:
         download if not existing, and save to disk
         else load from disk
         parse using specified parser function
         return required data
+
+    Response validators (etag etc) are kept in a .meta.json file next to
+    the cached file, so an update can be a conditional request - if the
+    server says not modified, the cached data is returned as is
+
+    The meta file also records when the resource was fetched.  If the
+    race_start is passed, cached data that has gone stale under the
+    parser's policy in cache_policy.py is refetched
+
+    If the race has a store open (see store.py) the cached file and
+    meta are kept in that instead of on disk
     """
 
     new_data, old_data = None, None
 
     # get new data if required
-    if not fpath.exists() or update:
+    if (not store.exists(fpath) or update
+            or resource_is_stale(fpath, parser, race_start)):
         # look up the parser function
         func = get_func(parser)
+        meta = load_meta(fpath) if store.exists(fpath) else {}
+        validators = meta.get('validators', {})
+        fetched = datetime.now()
         try:
-            new_data = func(url)
+            if parser in CONDITIONAL_PARSERS:
+                new_data = func(url, validators=validators)
+            else:
+                new_data = func(url)
             LOG.info(f'loaded {url} with {parser}')
+        except NotModified:
+            LOG.info(f'{url} not modified, using cached data')
+            save_meta(make_meta(url, parser, validators, fetched,
+                                race_start), fpath)
+            return load_json_or_html(fpath)
         except:
+            if store.exists(fpath):
+                LOG.info(f'cant get {url} with {parser}, using cached data')
+                return load_json_or_html(fpath)
             LOG.info(f'cant get {url} with {parser}, returning None')
             return None
 
+        save_meta(make_meta(url, parser, validators, fetched, race_start),
+                  fpath)
+
     # will always want to load existing data if its there
-    if fpath.exists():
-        with open(fpath, 'r') as fp:
-            if fpath.name.endswith('json'):
-                old_data = json.load(fp)
-            elif fpath.name.endswith('html'):
-                old_data = fp.read()
+    if store.exists(fpath):
+        old_data = load_json_or_html(fpath)
 
     # if no actually new data to save, just return now
     if new_data is None or new_data == old_data:
         return old_data
 
-    if update and fpath.exists():
+    if update and store.exists(fpath):
         old_path = fpath.parent / f"{fpath.name}.old"
         print('data has changed, saving old data to', old_path)
         save_json_or_html(old_data, old_path)
@@ -52,32 +91,188 @@ def get_resource(url, fpath, parser, update=False):
 
     return new_data
 
+def fetch_resources(resources, update=False, max_workers=8, per_host=None,
+                    pool=None, timings=None):
+    """
+    Fill the caches for a list of resources concurrently.
+
+    Each resource is a dict of get_resource() kwargs (url, fpath, parser).
+    Resources already on disk (and not stale) are skipped unless
+    update=True, or the resource has update=True itself.
+    Requests to any one host are capped at per_host at a time, or by
+    default the limit shared with all other fetching (see session.py)
+
+    Pass a ThreadPoolExecutor as pool to run on that rather than a new
+    one, and a list as timings to have {'fpath', 'url', 'secs'} dicts
+    added to it for each resource fetched.
+
+    Returns the number of resources actually fetched
+    """
+    todo = [dict(res, update=update or res.get('update', False))
+            for res in resources]
+    todo = [res for res in todo
+            if res['update'] or not store.exists(res['fpath'])
+            or resource_is_stale(res['fpath'], res['parser'],
+                                 res.get('race_start'))]
+
+    if not todo:
+        return 0
+
+    if per_host is not None:
+        host_locks = {}
+        for res in todo:
+            host = get_host(res['url'])
+            if host not in host_locks:
+                host_locks[host] = threading.BoundedSemaphore(per_host)
+
+        def slot(url):
+            return host_locks[get_host(url)]
+    else:
+        slot = session.host_slot
+
+    def fetch(res):
+        res['fpath'].parent.mkdir(parents=True, exist_ok=True)
+        with slot(res['url']):
+            start = time.perf_counter()
+            out = get_resource(**res)
+            if timings is not None:
+                timings.append({'fpath': res['fpath'], 'url': res['url'],
+                                'secs': time.perf_counter() - start})
+            return out
+
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(fetch, todo))
+    else:
+        list(pool.map(fetch, todo))
+
+    LOG.info(f'fetched {len(todo)} resources')
+
+    return len(todo)
+
+
+def load_json_or_html(fpath):
+    text = store.read_text(fpath)
+
+    if fpath.name.endswith('json'):
+        return serial.loads(text)
+    elif fpath.name.endswith('html'):
+        return text
+
+
+def meta_fpath(fpath):
+    """
+    Where the metadata for a cached file lives, eg
+    .pcs_race.json -> .pcs_race.json.meta.json
+    """
+    return fpath.parent / f"{fpath.name}.meta.json"
+
+
+def load_meta(fpath):
+    """
+    Return the metadata dict for the cached file at fpath, or {}
+    """
+    meta_fp = meta_fpath(fpath)
+
+    if not store.exists(meta_fp):
+        return {}
+
+    return serial.read_json(meta_fp)
+
+
+def make_meta(url, parser, validators, fetched, race_start=None):
+    return {
+        'url': url,
+        'parser': parser,
+        'validators': validators,
+        'fetched': fetched.isoformat(),
+        'expires': get_expiry(fetched, parser, race_start),
+    }
+
+
+def resource_is_stale(fpath, parser, race_start=None):
+    """
+    Is the cached file at fpath stale under the parser's cache policy?
+    """
+    if race_start is None or not store.exists(fpath):
+        return False
+
+    return is_stale(get_fetched(fpath), parser, race_start)
+
+
+def resource_expiry(fpath, parser, race_start=None):
+    """
+    When the cached file at fpath goes stale under the parser's ttl for
+    the current phase, as a datetime, or None if it won't
+    """
+    if race_start is None or not store.exists(fpath):
+        return None
+
+    ttl = get_ttl(parser, race_start)
+
+    if ttl is None:
+        return None
+
+    return get_fetched(fpath) + ttl
+
+
+def get_fetched(fpath):
+    """
+    When the cached file at fpath was fetched, from the meta file or the
+    file mtime if there isn't one (ie cached before meta files were kept)
+    """
+    fetched = load_meta(fpath).get('fetched')
+
+    if fetched is not None:
+        return datetime.fromisoformat(fetched)
+
+    return datetime.fromtimestamp(store.mtime(fpath))
+
+
+def is_newer(fpath, other):
+    """
+    Has fpath been modified since other was?  Used to tell if something
+    parsed from a cached file (eg .cs_data.json from .cs.html) is out of date
+    """
+    if not store.exists(fpath) or not store.exists(other):
+        return False
+
+    return store.mtime(fpath) > store.mtime(other)
+
+
+def save_meta(meta, fpath):
+    save_json_or_html(meta, meta_fpath(fpath))
+
+
 def save_json_or_html(data, fpath):
-    with open(fpath, 'w') as fp:
-        if '.json' in fpath.name:
-            json.dump(data, fp, indent=4)
-        elif '.html' in fpath.name:
-            fp.write(data)
+    if '.json' in fpath.name:
+        serial.write_json(data, fpath)
+    elif '.html' in fpath.name:
+        store.write_text(fpath, data)
 
 
 # PARSER FUNCTIONS
-def cs_race_data(url):
+# NB procyclingstats and bs4 are imported in the parsers, so they are
+# only loaded when something is actually fetched
+def cs_race_data(url, validators=None):
     """
     Get html and save
     """
-    return requests.get(url).text
+    return session.conditional_get(url, validators).text
 
-def html(url):
+def html(url, validators=None):
     """
     Just request the html for passed url
     """
-    return requests.get(url).text
+    return session.conditional_get(url, validators).text
 
 
 def pcs_race_api(url):
     """
     API call
     """
+    import procyclingstats
+
     return procyclingstats.Race(url).parse()
 
 
@@ -85,14 +280,18 @@ def pcs_race_climbs_api(url):
     """
     API call
     """
+    import procyclingstats
+
     return procyclingstats.RaceClimbs(url).parse()['climbs']
 
 
-def pcs_profile_img_urls(url):
+def pcs_profile_img_urls(url, validators=None):
     """
     Scrape a pcs webpage that has all the stage profiles
     """
-    req = requests.get(url)
+    from bs4 import BeautifulSoup
+
+    req = session.conditional_get(url, validators)
     soup = BeautifulSoup(req.text, 'html.parser')
 
     out = [f"http://www.procyclingstats.com/{x['src']}"
@@ -105,12 +304,13 @@ def pcs_profile_img_urls(url):
     return out
 
 
-def pcs_route_img_url(url):
+def pcs_route_img_url(url, validators=None):
     """
     Scrape a pcs webpage that has the overall route, among other stuff.
     """
+    from bs4 import BeautifulSoup
 
-    req = requests.get(url)
+    req = session.conditional_get(url, validators)
     soup = BeautifulSoup(req.text, 'html.parser')
     imgs = [f"{PCS_MAIN}/{x['src']}" for x in soup.find_all('img')]
 
@@ -121,6 +321,8 @@ def pcs_startlist(url):
     """
     Just scrape the html and return it
     """
+    import procyclingstats
+
     return procyclingstats.RaceStartlist(
         url).parse()['startlist']
 
@@ -131,6 +333,8 @@ def pcs_stage_api(url):
     NB parse() method is not available until after race so
     get attrs individually
     """
+    import procyclingstats
+
     st = procyclingstats.Stage(url)
 
     out = {
@@ -152,7 +356,30 @@ def pcs_stage_api(url):
     return out
 
 
-def pcs_stage_img_urls(url):
+def pcs_stage_results(url):
+    """
+    API call - the stage results, and the pcs gc after the stage to
+    check ours against (see get_gc.build_gcs).
+    Returns None until the gc is up, so nothing is cached before then
+    """
+    import procyclingstats
+
+    st = procyclingstats.Stage(url)
+
+    gc = st.gc('rider_name', 'rider_url', 'team_name', 'rank', 'time',
+               'bonus')
+
+    if not gc:
+        return None
+
+    return {
+        'results': st.results('rider_name', 'rider_url', 'team_name',
+                              'rank', 'status', 'time', 'bonus'),
+        'gc': gc,
+    }
+
+
+def pcs_stage_img_urls(url, validators=None):
     """
     Scrape pcs stage webpage that has all the stage imgs
 
@@ -161,7 +388,9 @@ def pcs_stage_img_urls(url):
     helps for that.
     May be able to infer from this what file the route is
     """
-    req = requests.get(url)
+    from bs4 import BeautifulSoup
+
+    req = session.conditional_get(url, validators)
     soup = BeautifulSoup(req.text, 'html.parser')
 
     imgs = [f"{PCS_MAIN}/{x['src']}" for x in soup.find_all('img')]
@@ -1,5 +1,8 @@
-from procyclingstats import RaceStartlist
+import re
 from .urls import make_pcs_url
+from . import session
+# the team and rider names are sanitized in names.py
+from .names import TEAMTAGS, sanitize_team, sanitize_rider
 
 """
 I think that to get the underlying list of teams from PCS you have to
@@ -8,47 +11,6 @@ use the /teams object from procyclingstats.Stage, eg:
 """
 
 
-# a list of understandable tags that can be found in full names and
-# used in their place
-TEAMTAGS = [
-    'UAE', 'Visma', 'Jayco', 'Ineos', 'Lidl', 'Decathlon', 'Bahrain',
-    'Quick-Step', 'Bora', 'FDJ', 'Alpecin', 'EF', 'Lotto', 'Israel',
-    'Cofidis', 'Movistar', 'Arkéa', 'Arkea', 'Intermarché', 'Intermarche',
-    'Picnic', 'Astana', 'Uno-X', 'TotalEnergies', 'Tudor',
-    'dsm', 'Q36.5', 'Bardiani', 'Polti', 'Vini Fantini', 'Euskatel', 'Euskadi',
-    'Burgos',
-    'Caja Rural', 'Kern Pharma'
-]
-def sanitize_team(team):
-    """
-    Return a good name
-    """
-    tags = [x for x in TEAMTAGS if x.lower() in team.lower()]
-
-    if tags:
-        tag = tags[0]
-    else:
-        print('cannot find a tag for', team)
-        return team
-
-    if tag == 'Israel':
-        return 'Genocidal'
-
-    if tag in ['dsm', 'Picnic']:
-        return 'Picnic-Post'
-
-    if tag == 'Bardiani':
-        return 'Voo Effay Bardiani'
-
-    if tag == 'Euskadi':
-        return 'Euskatel'
-
-    if tag == 'FDJ':
-        return 'Groupama-FDJ'
-
-    return tag
-
-
 def make_teams_dict(pcs_json=None, pcs_startlist_url=None,
                     race=None, sanitize=True):
     """
@@ -94,6 +56,7 @@ def get_pcs_teams(pcs_url):
     """
     Return the native list of rider dicts
     """
+    from procyclingstats import RaceStartlist
 
     return RaceStartlist(pcs_url).parse()['startlist']
 
@@ -106,7 +69,9 @@ def get_cs_teams(url=None, soup=None, just_return_soup=False):
     """
 
     if soup is None:
-        req = requests.get(url)
+        from bs4 import BeautifulSoup
+
+        req = session.get(url)
 
         if not req.ok:
             raise ValueError("cannot download teams from", url)
@@ -136,33 +101,3 @@ def get_cs_teams(url=None, soup=None, just_return_soup=False):
                             for num, rider in zip(nums, riders)}
         
     return teams
-
-
-def sanitize_rider(rider):
-    """
-    Make them good
-    """
-
-    if 'sepp' in rider.lower():
-        return 'CUCK Sepp'
-
-    if 'vingegaard' in rider.lower():
-        return 'VINEGARED Jonas'
-
-    if 'jhon' in rider.lower():
-        return 'NARVAEZ Johnathan'
-
-    if 'remco' in rider.lower():
-        return 'REMCO'
-
-    if 'soler' in rider.lower():
-        return 'SUNSHINE Mister'
-
-    if 'lipowitz' in rider.lower():
-        return 'FLIPPOWITZ Lorian'
-
-    if 'ganna' in rider.lower():
-        return 'GAN-NA Filippo'
-
-    return rider
-
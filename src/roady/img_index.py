@@ -0,0 +1,122 @@
+"""
+A per-race index of image metadata, so layout can be worked out without
+opening the image files.
+
+Held in .img_index.json in the race dir, keyed by path relative to it:
+    {
+        'stage_4/pcs_imgs/tour-de-france-2025-stage-4-profile.jpg': {
+            'width': 1000, 'height': 420, 'format': 'JPEG',
+            'bytes': 81234, 'mtime_ns': ..., 'sha256': '...'
+        },
+    }
+
+Entries are filled when an image is downloaded (or first measured) and
+are ignored if the file's size or mtime have since changed.
+"""
+import os
+import threading
+
+from .blobs import file_hash
+from .serial import dumps, loads
+
+
+class ImageIndex:
+
+    def __init__(self, dpath):
+        """
+        Load the index for the race dir at dpath, if there is one
+        """
+        self.dpath = dpath
+        self.fpath = dpath / '.img_index.json'
+        self._lock = threading.Lock()
+
+        if self.fpath.exists():
+            self._data = loads(self.fpath.read_text())
+        else:
+            self._data = {}
+
+    def _key(self, fpath):
+        try:
+            return fpath.relative_to(self.dpath).as_posix()
+        except ValueError:
+            return fpath.as_posix()
+
+    def get(self, fpath):
+        """
+        Return the metadata dict for the image at fpath, or None if not
+        indexed or the file has changed since
+        """
+        entry = self._data.get(self._key(fpath))
+
+        if entry is None or not fpath.exists():
+            return None
+
+        stat = fpath.stat()
+        if (stat.st_size != entry['bytes']
+                or stat.st_mtime_ns != entry['mtime_ns']):
+            return None
+
+        return entry
+
+    def add(self, fpath, save=True):
+        """
+        Measure the image at fpath and index it.  Returns the entry
+        """
+        from PIL import Image as PILImage
+
+        stat = fpath.stat()
+
+        with PILImage.open(fpath) as img:
+            entry = {
+                'width': img.width,
+                'height': img.height,
+                'format': img.format,
+                'bytes': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': file_hash(fpath),
+            }
+
+        with self._lock:
+            self._data[self._key(fpath)] = entry
+
+        if save:
+            self.save()
+
+        return entry
+
+    def __getstate__(self):
+        # so Race can be sent to worker processes - locks won't pickle
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def width_height(self, fpath):
+        """
+        Return (width, height) from the index, measuring if required
+        """
+        entry = self.get(fpath)
+
+        if entry is None:
+            entry = self.add(fpath)
+
+        return entry['width'], entry['height']
+
+    def content_hash(self, fpath):
+        entry = self.get(fpath)
+
+        if entry is None:
+            entry = self.add(fpath)
+
+        return entry['sha256']
+
+    def save(self):
+        with self._lock:
+            # pid in the tmp name, as pages may be drawn in other processes
+            tmp = self.fpath.parent / f"{self.fpath.name}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as fp:
+                fp.write(dumps(self._data))
+            os.replace(tmp, self.fpath)
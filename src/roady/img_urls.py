@@ -0,0 +1,195 @@
+"""
+Classifying image urls from cs and pcs: which stage, source, what the url
+says it is (title), the pcs index (eg n2) and file extension.
+
+>>> split_img_url(url)  # one url, as a dict
+>>> tag_stage_imgs(urls, pcs_profile_url)  # profile / route / other tags
+>>> classify_img_urls(urls)  # lots of urls at once, as a df
+"""
+from functools import lru_cache
+import re
+import pandas as pd
+
+STAGE_IMG_RE = re.compile(r'stage-(\d{1,2})-(.*)\.(\w*)')
+
+# the elements of a pcs img url payload that say what it is
+PCS_TITLES = ['map', 'profile', 'finish', 'climb']
+PCS_TITLE_RE = re.compile(rf"(?:^|-)({'|'.join(PCS_TITLES)})(?=-|$)")
+PCS_IND_RE = re.compile(r"(?:^|-)([^-]{2})(?=-|$)")
+
+
+def tag_stage_imgs(urls, pcs_profile_url=None):
+    """
+    For a list of urls, return a list of {url: xx, tag: yy}
+    NB purpose is to assign 'route' and 'profile' tags
+
+    For PCS the profile url is known, and may be provided here
+    (NB this might be in http, not https lol)
+    """
+
+    if not urls:
+        print('no urls to tag')
+        return
+
+    imgs = {url: split_img_url(url) for url in urls}
+    source = list(imgs.values())[0]['source']
+
+    out = []  # will be a list of {'url': url, 'tag': tag}
+
+    profile, route = False, False
+
+    # first the case where a profile url is provided
+    if pcs_profile_url is not None:
+        url = pcs_profile_url.replace("http://", "https://")
+        if url in imgs:
+            out.append({'url': url, 'tag': 'profile'})
+            del imgs[url]
+
+        profile = True
+
+    if not profile:
+        for url, elems in imgs.items():
+            if elems['title'] == 'profile':
+                out.append({'url': url, 'tag': 'profile'})
+                del imgs[url]
+                break
+
+    # now the route
+    for url, elems in imgs.items():
+        if elems['title'] in ['route', 'map']:
+            out.append({'url': url, 'tag': 'route'})
+            del imgs[url]
+            break
+
+    # for pcs, it might be the first profile remaining
+    if profile and not route and source == 'pcs':
+        for url, elems in imgs.items():
+            if elems['title'] == 'profile':
+                out.append({'url': url, 'tag': 'route'})
+                del imgs[url]
+                break
+
+    # tag remaining urls as other
+    for url, elems in imgs.items():
+        out.append({'url': url, 'tag': 'other'})
+
+    return out
+
+
+def split_img_url(url):
+    """
+    Return the salient elements of the url, splitting out recognizable
+    elements like f_ext.
+    Does not attempt to assign a type, but the naively reported title
+    may be the same as the type, especially for cs.
+
+    Memoized - the same urls get split on every tag_imgs build
+    """
+    return dict(_split_img_url(url))
+
+
+@lru_cache(maxsize=4096)
+def _split_img_url(url):
+
+    out = {
+        'url': url.split('/')[-1],
+        'title': None,  # eg 'route-finale' or 'galibier'
+        'source': None,  # 'cs' or 'pcs'
+        'f_ext': url.split('.')[-1],
+        'ind': None,  # pcs has this
+        'extra_payload': None,  # catch-all
+    }
+
+    if 'cyclingstage.com' in url:
+
+        out['source'] = 'cs'
+
+        # this filters out the overall route img
+        if 'stage-' not in url:
+            title, f_ext = out['url'].split('.')
+            stage = None
+
+        else:
+            stage, title, f_ext = STAGE_IMG_RE.search(url).groups()
+
+        out['title'] = title
+        out['stage'] = stage
+        out['f_ext'] = f_ext
+
+    elif 'procyclingstats.com' in url:
+        out['source'] = 'pcs'
+
+        # this filters out the overall route img
+        if 'stage-' not in url and 'map' in url:
+            out['f_ext'] = out['url'].split('.')[-1]
+            out['title'] = 'overall_route'
+            out['stage'] = None
+
+        else:
+            stage, payload, f_ext = STAGE_IMG_RE.search(url).groups()
+
+            elems = payload.split('-')
+
+            for elem in elems:
+                if elem in PCS_TITLES:
+                    out['title'] = elem
+                if len(elem) == 2:  # i think always of form eg n2
+                    out['ind'] = elem
+                else:
+                    out['extra_payload'] = elem
+
+            out['stage'] = stage
+
+    return out
+
+
+def classify_img_urls(urls):
+    """
+    Classify a whole list of urls at once (eg all cs and pcs urls for a
+    race), using vectorised string ops rather than a python loop.
+
+    Returns a df indexed by url with cols stage, source, title, ind, ext,
+    matching what split_img_url() gives for each
+    """
+    urls = pd.Series(list(dict.fromkeys(urls)), dtype='object')
+
+    fname = urls.str.rsplit('/', n=1).str[-1]
+    is_cs = urls.str.contains('cyclingstage.com', regex=False)
+    is_pcs = ~is_cs & urls.str.contains('procyclingstats.com', regex=False)
+    has_stage = urls.str.contains('stage-', regex=False)
+
+    parts = urls.str.extract(STAGE_IMG_RE)
+    parts.columns = ['stage', 'payload', 'ext']
+
+    df = pd.DataFrame({
+        'stage': parts['stage'].where(has_stage),
+        'source': None,
+        'title': None,
+        'ind': None,
+        'ext': urls.str.rsplit('.', n=1).str[-1],
+    })
+    df.index = urls.values
+    df.index.name = 'url'
+
+    df.loc[is_cs.values, 'source'] = 'cs'
+    df.loc[is_pcs.values, 'source'] = 'pcs'
+
+    # cs: the title is the payload, or the file name for the overall route
+    cs_stage = (is_cs & has_stage).values
+    cs_other = (is_cs & ~has_stage).values
+    df.loc[cs_stage, 'title'] = parts['payload'].values[cs_stage]
+    df.loc[cs_stage, 'ext'] = parts['ext'].values[cs_stage]
+    df.loc[cs_other, 'title'] = fname.str.split('.').str[0].values[cs_other]
+
+    # pcs: title and ind are the last of their kind of payload element
+    pcs_route = (is_pcs & ~has_stage & urls.str.contains('map')).values
+    pcs_stage = is_pcs.values & ~pcs_route
+    payload = parts['payload'].fillna('')
+    df.loc[pcs_route, 'title'] = 'overall_route'
+    df.loc[pcs_stage, 'title'] = (
+        payload.str.findall(PCS_TITLE_RE).str[-1].values[pcs_stage])
+    df.loc[pcs_stage, 'ind'] = (
+        payload.str.findall(PCS_IND_RE).str[-1].values[pcs_stage])
+    df.loc[pcs_stage, 'ext'] = parts['ext'].values[pcs_stage]
+
+    return df.astype(object).where(df.notna(), None)
@@ -0,0 +1,179 @@
+"""
+Turning raw pcs team and rider names into the names printed.
+
+Each kind of name has a list of rules, (substring, display name), in
+priority order: a name gets the display name of the first rule whose
+substring it contains (ignoring case), or is left as is.
+
+The rules are compiled once into a single regex, and each raw name is
+only looked up once (then remembered), so a whole season's startlists
+and gcs can go through:
+>>> sanitize_team('UAE Team Emirates - XRG')
+'UAE'
+>>> TEAMS.map(df['team_name'])
+
+Extra rules can be put in DATA_DIR/name_overrides.json, which come before
+the ones here, eg:
+    {
+        "teams": {"Soudal": "Wolfpack"},
+        "riders": {"pogacar": "POGI"}
+    }
+Edits to the file are picked up on the next name looked up.
+"""
+import json
+import re
+import threading
+
+from .constants import DATA_DIR
+
+OVERRIDES_FPATH = DATA_DIR / 'name_overrides.json'
+
+# a list of understandable tags that can be found in full names and
+# used in their place
+TEAMTAGS = [
+    'UAE', 'Visma', 'Jayco', 'Ineos', 'Lidl', 'Decathlon', 'Bahrain',
+    'Quick-Step', 'Bora', 'FDJ', 'Alpecin', 'EF', 'Lotto', 'Israel',
+    'Cofidis', 'Movistar', 'Arkéa', 'Arkea', 'Intermarché', 'Intermarche',
+    'Picnic', 'Astana', 'Uno-X', 'TotalEnergies', 'Tudor',
+    'dsm', 'Q36.5', 'Bardiani', 'Polti', 'Vini Fantini', 'Euskatel', 'Euskadi',
+    'Burgos',
+    'Caja Rural', 'Kern Pharma'
+]
+
+# tags printed as something else
+TEAM_RENAMES = {
+    'Israel': 'Genocidal',
+    'dsm': 'Picnic-Post',
+    'Picnic': 'Picnic-Post',
+    'Bardiani': 'Voo Effay Bardiani',
+    'Euskadi': 'Euskatel',
+    'FDJ': 'Groupama-FDJ',
+}
+
+RIDER_RULES = [
+    ('sepp', 'CUCK Sepp'),
+    ('vingegaard', 'VINEGARED Jonas'),
+    ('jhon', 'NARVAEZ Johnathan'),
+    ('remco', 'REMCO'),
+    ('soler', 'SUNSHINE Mister'),
+    ('lipowitz', 'FLIPPOWITZ Lorian'),
+    ('ganna', 'GAN-NA Filippo'),
+]
+
+TEAM_RULES = [(tag, TEAM_RENAMES.get(tag, tag)) for tag in TEAMTAGS]
+
+
+class NameMap:
+    """
+    Display names for raw names by a list of rules, see above.
+    kind is the key for this map's rules in the override file
+    """
+
+    def __init__(self, kind, rules, warn_missing=False):
+        self.kind = kind
+        self.rules = rules
+        self.warn_missing = warn_missing
+        self._lock = threading.Lock()
+        self._overrides_mtime = None
+        self._build()
+
+    def _build(self, overrides=None):
+        """
+        Compile the rules, with any overrides first, and clear the memo
+        """
+        rules = list((overrides or {}).items()) + self.rules
+
+        # first rule for each substring, by the substring in lower case
+        displays = {}
+        for sub, display in rules:
+            displays.setdefault(sub.lower(), display)
+
+        # a lookahead, so a match is found at every position even where
+        # they overlap, and the alternatives are in priority order
+        alts = '|'.join(re.escape(x) for x in displays)
+        self._regex = re.compile(f"(?=({alts}))") if alts else None
+        self._priority = {sub: i for i, sub in enumerate(displays)}
+        self._displays = displays
+        self._memo = {}
+
+    def _check_overrides(self):
+        """
+        Rebuild if the override file has changed since last looked at
+        """
+        try:
+            mtime = OVERRIDES_FPATH.stat().st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self._overrides_mtime:
+            return
+
+        with self._lock:
+            overrides = {}
+            if mtime is not None:
+                try:
+                    overrides = json.loads(
+                        OVERRIDES_FPATH.read_text()).get(self.kind, {})
+                except ValueError as e:
+                    print(f'cannot read {OVERRIDES_FPATH}: {e}')
+
+            self._build(overrides)
+            self._overrides_mtime = mtime
+
+    def __call__(self, name):
+        self._check_overrides()
+
+        return self._get(name)
+
+    def _get(self, name):
+        if name in self._memo:
+            return self._memo[name]
+
+        out = self._lookup(name)
+        self._memo[name] = out
+
+        return out
+
+    def _lookup(self, name):
+        subs = []
+        if self._regex is not None:
+            subs = [x.group(1) for x in self._regex.finditer(name.lower())]
+
+        if not subs:
+            if self.warn_missing:
+                print(f'cannot find a {self.kind} tag for', name)
+            return name
+
+        return self._displays[min(subs, key=self._priority.get)]
+
+    def map(self, names):
+        """
+        The display names for a pandas series of raw names, or a list
+        """
+        self._check_overrides()
+
+        if hasattr(names, 'map'):
+            return names.map({x: self._get(x) for x in names.unique()})
+
+        return [self._get(x) for x in names]
+
+    def __repr__(self):
+        return f"NameMap('{self.kind}', {len(self._displays)} rules)"
+
+
+TEAMS = NameMap('teams', TEAM_RULES, warn_missing=True)
+RIDERS = NameMap('riders', RIDER_RULES)
+
+
+def sanitize_team(team):
+    """
+    Return a good name
+    """
+    return TEAMS(team)
+
+
+def sanitize_rider(rider):
+    """
+    Make them good
+    """
+    return RIDERS(rider)
@@ -2,10 +2,30 @@
 Functions for scraping cyclingstage.com
 """
 from pathlib import Path
-from bs4 import BeautifulSoup
 import re
 from datetime import datetime
 
+# lxml is much faster if it's there
+try:
+    import lxml
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+JPG_RE = re.compile('.jpg')
+STAGE_URL_RE = re.compile(r'stage-(\d*)-')
+ROUTE_IMG_RE = re.compile(r'route-.*jpg')
+DT_RE = re.compile(r"(\w*?),?\s(\d{1,2})\s?(\w*?)\s")
+KM_RE = re.compile(r"\d{1,3}\.?\d*\s*kilomet")
+
+
+def make_soup(html):
+    # bs4 is slow to import, so only when there's something to parse
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, PARSER)
+
+
 def parse_cs_race_html(html):
     """
     Get:
@@ -19,7 +39,7 @@ def parse_cs_race_html(html):
         'route_img_url': None,
     }
 
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
 
     # search links for stage and riders urls
     for elem in soup.find_all('a'):
@@ -34,8 +54,7 @@ def parse_cs_race_html(html):
             out['riders_url'] = href
             continue
 
-        ST_RE = r'stage-(\d*)-'
-        stage_re = re.search(ST_RE, href)
+        stage_re = STAGE_URL_RE.search(href)
 
         if stage_re is not None and 'route' in href and 'http' in href:
             out['stage_urls'].append(href)
@@ -43,30 +62,10 @@ def parse_cs_race_html(html):
     for elem in soup.find_all('img'):
         url = elem['src']
 
-        if re.search(r'route-.*jpg', url):
+        if ROUTE_IMG_RE.search(url):
             out['route_img_url'] = url.replace('-100', '')
 
-    tds = soup.find_all('td')
-
-    out['stage_data'] = []
-    stage = 1
-    i = 0
-    while i < len(tds):
-        td = tds[i]
-        cl = td.get('class', [None])[0]
-
-        if td.text == str(stage) and cl == 'left':
-            out['stage_data'].append({
-                'stage': stage,
-                'date': tds[i+1].text,
-                'title': tds[i+2].text.split(str(stage))[-1].strip(),
-                'distance': float(tds[i+3].text.replace(',', '.')),
-                'type': tds[i+4].text,
-            })
-            i += 5
-            stage += 1
-        else:
-            i += 1
+    out['stage_data'] = get_stage_table(soup)
 
     return out
 
@@ -75,42 +74,63 @@ def get_stages_overview(html):
     """
     The list of stages, with date, title, distance, type
     """
+    return get_stage_table(make_soup(html))
 
-    soup = BeautifulSoup(html, 'html.parser')
 
-    tds = soup.find_all('td')
+def get_stage_table(soup):
+    """
+    The list of stages from the overview table, as dicts with
+    stage, date, title, distance, type.
 
+    One pass over the table rows: a stage row starts with a 'left'
+    class cell holding the next stage number
+    """
     out = []
-    stage = 1
-    i = 0
-    while i < len(tds):
-        td = tds[i]
-        cl = td.get('class', [None])[0]
-
-        if td.text == str(stage) and cl == 'left':
-            out.append({
-                'stage': stage,
-                'date': tds[i+1].text,
-                'title': tds[i+2].text.split(str(stage))[-1].strip(),
-                'distance': float(tds[i+3].text.replace(',', '.')),
-                'type': tds[i+4].text,
-            })
-            i += 5
-            stage += 1
-        else:
-            i += 1
+
+    for row in soup.find_all('tr'):
+        tds = row.find_all('td')
+
+        if len(tds) < 5:
+            continue
+
+        stage = len(out) + 1
+        cl = tds[0].get('class', [None])[0]
+        texts = [td.text for td in tds[:5]]
+
+        if texts[0] != str(stage) or cl != 'left':
+            continue
+
+        out.append({
+            'stage': stage,
+            'date': texts[1],
+            'title': texts[2].split(str(stage))[-1].strip(),
+            'distance': parse_distance(texts[3]),
+            'type': texts[4],
+        })
 
     return out
 
 
+def parse_distance(text):
+    """
+    eg '183,5' -> 183.5, or None if not a number
+    """
+    try:
+        return float(text.replace(',', '.'))
+    except ValueError:
+        return None
+
+
 
 def parse_cs_stage_html(html):
     """
     The main cs stage data
     Can also get stage urls 
+
+    Parses the html once, the rest are lookups on that soup
     """
 
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
 
     stage_date, description, dt = get_description(soup)
 
@@ -120,12 +140,9 @@ def parse_cs_stage_html(html):
     out['from_to'] = title_text.split(':')[1].strip()
     out['description'] = description
     out['parsed_distance'] = infer_km(description)
-    out['blurb'] = get_blurb(html)
+    out['blurb'] = get_blurb(soup)
 
-    jpg_urls = [
-        x.get('src') for x in soup.find_all(
-            attrs={'src': re.compile('.jpg')})
-    ]
+    jpg_urls = [x.get('src') for x in soup.find_all(src=JPG_RE)]
 
     # drop non-stage ones
     jpg_urls = [x for x in jpg_urls if 'stage-' in x]
@@ -143,10 +160,8 @@ def get_description(soup):
     This is a bit tricky so separate function
     Returns date, description
     """
-    DT_RE = r"(\w*?),?\s(\d{1,2})\s?(\w*?)\s"
-
-    out = soup.find_all('p')[0].text
-    weekday, day, month = re.search(DT_RE, out).groups()
+    out = soup.find('p').text
+    weekday, day, month = DT_RE.search(out).groups()
 
     desc = "".join(out.split(month)[1:]).strip()
     desc = re.sub(rf"\s?[{chr(8211)}-]\s", '', desc)
@@ -162,9 +177,13 @@ def get_description(soup):
 def get_blurb(html):
     """
     The article text (not the headline which is 'description')
+    Pass the html or an already made soup
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    paras = soup.find_all('article')[0].find_all('p')
+    if isinstance(html, str):
+        soup = make_soup(html)
+    else:
+        soup = html
+    paras = soup.find('article').find_all('p')
     out = [x.text for x in paras
            if not 'Click on the images' in x.text
            or 'GPX' in x.text]
@@ -177,8 +196,7 @@ def infer_km(description):
     Its in there as eg "153.2 kilometres to go"
     """
 
-    match = re.search(re.compile(r"\d{1,3}\.?\d*\s*kilomet"),
-                      description)
+    match = KM_RE.search(description)
 
     if match:
         res = match.group()
@@ -0,0 +1,77 @@
+"""
+Reading and writing the json caches.
+
+Written compact, with orjson if it's there (much faster both ways) and
+the stdlib json if not.  Either reads the other's files, and the older
+pretty printed (indent=4) ones.
+
+Files people edit by hand (PRETTY) are still written indented:
+
+>>> write_json(data, stage.dpath / 'img_urls_tags.json')  # pretty
+>>> write_json(data, stage.dpath / '.pcs_data.json')  # compact
+
+read_json / write_json go through the race store if there is one, see
+store.py
+"""
+import json
+
+from . import store
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the files edited by hand, written indented
+PRETTY = ['img_urls_tags.json']
+
+if orjson is not None:
+    # pcs data can have int keys, stdlib json makes them strs
+    ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data, pretty=False):
+    """
+    Return data as a json str
+    """
+    if pretty:
+        return json.dumps(data, indent=4)
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=ORJSON_OPTS).decode()
+        except TypeError:
+            # eg ints too big for orjson, stdlib copes
+            pass
+
+    return json.dumps(data, separators=(',', ':'))
+
+
+def loads(text):
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # stdlib writes NaN / Infinity, which orjson won't read
+            pass
+
+    return json.loads(text)
+
+
+def is_pretty(fpath):
+    return fpath.name in PRETTY
+
+
+def read_json(fpath):
+    return loads(store.read_text(fpath))
+
+
+def write_json(data, fpath, pretty=None):
+    """
+    Save data to fpath, compact unless pretty=True or it's a
+    file people edit by hand (see PRETTY)
+    """
+    if pretty is None:
+        pretty = is_pretty(fpath)
+
+    store.write_text(fpath, dumps(data, pretty))
@@ -0,0 +1,212 @@
+"""
+One shared http session for all the fetchers.
+
+Keeps connections to cyclingstage.com, procyclingstats.com and their cdns
+alive between requests, and retries with exponential backoff when the
+sites push back (429) or fall over (5xx).
+
+>>> from roady.session import get, connection_stats
+>>> req = get("https://www.cyclingstage.com")
+>>> connection_stats()
+{'requests': 1, 'connections': 1, 'reused': 0}
+
+Timeouts etc can be changed for the whole session:
+>>> configure(timeout=(5, 60), retries=6)
+
+Everything fetching concurrently (resources, images, several races at
+once) shares a limit of PER_HOST requests at a time to any one host:
+>>> with host_slot(url):
+...     req = get(url)
+"""
+import threading
+from urllib.parse import urlparse
+
+from .constants import LOG
+from .urls import PCS_MAIN
+from .errors import NotModified
+
+# (connect, read) seconds
+TIMEOUT = (5, 30)
+RETRIES = 4
+# waits are BACKOFF * 2 ** (retry - 1), ie 0.5, 1, 2, 4..
+BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# connections kept alive per host
+POOL_SIZE = 8
+# requests at a time per host, across all threads
+PER_HOST = 4
+
+_session = None
+_lock = threading.Lock()
+# semaphores by host, see host_slot()
+_host_slots = {}
+
+
+def configure(timeout=None, retries=None, backoff=None, pool_size=None,
+              per_host=None):
+    """
+    Change the session settings.  The session is rebuilt on next use
+    (so don't call while fetching)
+    """
+    global TIMEOUT, RETRIES, BACKOFF, POOL_SIZE, PER_HOST, _session
+
+    if timeout is not None:
+        TIMEOUT = timeout
+    if retries is not None:
+        RETRIES = retries
+    if backoff is not None:
+        BACKOFF = backoff
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if per_host is not None:
+        PER_HOST = per_host
+
+    with _lock:
+        _host_slots.clear()
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_session():
+    """
+    Return the shared session, making it if required
+    """
+    global _session
+
+    with _lock:
+        if _session is None:
+            _session = make_session()
+
+    return _session
+
+
+def get_host(url):
+    """
+    Return the host for a url.  The procyclingstats api takes relative
+    urls, eg 'race/tour-de-france/2025', so these go to pcs
+    """
+    host = urlparse(url).netloc
+
+    if not host:
+        return urlparse(PCS_MAIN).netloc
+
+    return host
+
+
+def host_slot(url):
+    """
+    The semaphore capping requests to the url's host at PER_HOST at a
+    time, shared by all the fetching threads
+    """
+    host = get_host(url)
+
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(PER_HOST)
+
+        return _host_slots[host]
+
+
+def make_session():
+    """
+    A requests session with pooling and retries on all urls
+    """
+    # requests is slow to import, so only when first needed
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=['GET', 'HEAD'],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE,
+                          pool_maxsize=POOL_SIZE,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get(url, **kwargs):
+    """
+    Drop-in for requests.get, using the shared session
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+
+    return get_session().get(url, **kwargs)
+
+
+def conditional_get(url, validators=None, **kwargs):
+    """
+    Get the url, sending any validators (etag, last_modified) from a
+    previous response so the server can answer 304 if nothing changed.
+
+    Raises NotModified on a 304.  Otherwise the validators dict is
+    updated in place with those from the new response
+    """
+    if validators is None:
+        validators = {}
+
+    headers = kwargs.pop('headers', {})
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    req = get(url, headers=headers, **kwargs)
+
+    if req.status_code == 304:
+        raise NotModified(url)
+
+    validators.clear()
+    if req.headers.get('ETag'):
+        validators['etag'] = req.headers['ETag']
+    if req.headers.get('Last-Modified'):
+        validators['last_modified'] = req.headers['Last-Modified']
+
+    return req
+
+
+def connection_stats():
+    """
+    Return counts of requests made, connections opened and so
+    connections reused, over all hosts in the session
+    """
+    out = {'requests': 0, 'connections': 0, 'reused': 0}
+
+    if _session is None:
+        return out
+
+    adapters = {id(x): x for x in _session.adapters.values()}
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            out['requests'] += pool.num_requests
+            out['connections'] += pool.num_connections
+
+    out['reused'] = out['requests'] - out['connections']
+
+    return out
+
+
+def log_connection_stats():
+    stats = connection_stats()
+    LOG.info(f"http: {stats['requests']} requests, "
+             f"{stats['connections']} connections, "
+             f"{stats['reused']} reused")
+
+    return stats
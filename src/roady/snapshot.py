@@ -0,0 +1,167 @@
+"""
+Snapshots of built races, so opening a fully cached race is one read
+rather than re-loading and re-processing every race and stage file.
+
+Race saves the whole processed object (stages, climbs, tags, teams,
+image index etc) to .snapshot.pkl in the race dir after building, and
+loads it next time instead if it's still good:
+    - none of the cache files it was built from have changed (mtimes,
+      in the race store if there is one), nor the roady code
+    - none of the cached resources have gone stale (see cache_policy.py),
+      so a normal build wouldn't refetch anything
+
+Nothing is saved unless all the race and stage resources are cached.
+"""
+from datetime import datetime, time
+import os
+from pathlib import Path
+import pickle
+
+from . import store
+from .cache_policy import get_phase_end
+from .constants import LOG
+from .get_resources import meta_fpath, resource_expiry
+from .Stage import stage_resources
+
+SNAPSHOT_NAME = '.snapshot.pkl'
+
+# bump if a change means old snapshots can't be used
+# (editing the code invalidates them anyway, see code_mtime())
+SNAPSHOT_VERSION = 1
+
+CODE_DPATH = Path(__file__).parent
+
+
+def save_snapshot(race):
+    """
+    Save the built race to its dir, if all its resources are cached
+    """
+    resources = snapshot_resources(race)
+
+    missing = [x['fpath'] for x in resources if not store.exists(x['fpath'])]
+    if missing:
+        LOG.info(f'{len(missing)} resources not cached, no snapshot saved')
+        return None
+
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'code_mtime': code_mtime(),
+        'manifest': make_manifest(race.dpath,
+                                  snapshot_files(race, resources)),
+        'valid_until': get_valid_until(resources, race._race_start),
+        'race': race,
+    }
+
+    fpath = race.dpath / SNAPSHOT_NAME
+    tmp = fpath.parent / f"{fpath.name}.{os.getpid()}.tmp"
+
+    with open(tmp, 'wb') as fp:
+        pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, fpath)
+
+    LOG.info(f'saved snapshot of {race._race}')
+
+    return fpath
+
+
+def load_snapshot(dpath):
+    """
+    Return the race saved in dpath, or None if there isn't one or it's
+    out of date
+    """
+    fpath = dpath / SNAPSHOT_NAME
+
+    if not fpath.exists():
+        return None
+
+    try:
+        with open(fpath, 'rb') as fp:
+            data = pickle.load(fp)
+    except Exception as e:
+        LOG.info(f'cannot load snapshot {fpath}: {e}')
+        return None
+
+    if (data.get('version') != SNAPSHOT_VERSION
+            or data['code_mtime'] != code_mtime()
+            or data['race'].dpath != dpath):
+        return None
+
+    if (data['valid_until'] is not None
+            and datetime.now() >= data['valid_until']):
+        LOG.info('snapshot has gone stale')
+        return None
+
+    if make_manifest(dpath, data['manifest']) != data['manifest']:
+        LOG.info('cache files changed since snapshot')
+        return None
+
+    LOG.info(f'loaded snapshot {fpath}')
+
+    return data['race']
+
+
+def snapshot_resources(race):
+    """
+    The get_resource() kwargs for the race and all its stages
+    """
+    out = list(race._resources().values())
+
+    for stage in race.stages:
+        out.extend(stage_resources(race._race, stage.stage_no, race.dpath,
+                                   race._race_start).values())
+
+    return out
+
+
+def snapshot_files(race, resources):
+    """
+    All the files that the built race depends on
+    """
+    out = []
+    for res in resources:
+        out.extend([res['fpath'], meta_fpath(res['fpath'])])
+
+    out.extend([race.dpath / '.cs_data.json',
+                race.dpath / 'calibration.csv',
+                race.dpath / '.img_index.json'])
+
+    for stage in race.stages:
+        out.extend([stage.dpath / '.cs_data.json',
+                    stage.dpath / 'img_urls_tags.json'])
+
+    return [x.relative_to(race.dpath).as_posix() for x in out]
+
+
+def make_manifest(dpath, files):
+    """
+    The mtime (or None if missing) for each file, by path relative to
+    the race dir
+    """
+    out = {}
+    for key in files:
+        fpath = dpath / key
+        out[key] = store.mtime(fpath) if store.exists(fpath) else None
+
+    return out
+
+
+def get_valid_until(resources, race_start):
+    """
+    When the first of the resources goes stale, or the race phase (and
+    so the ttls) changes, or None if never
+    """
+    out = [resource_expiry(x['fpath'], x['parser'], race_start)
+           for x in resources]
+
+    if race_start is not None:
+        phase_end = get_phase_end(race_start)
+        if phase_end is not None:
+            out.append(datetime.combine(phase_end, time.min))
+
+    out = [x for x in out if x is not None]
+
+    return min(out) if out else None
+
+
+def code_mtime():
+    return max(x.stat().st_mtime for x in CODE_DPATH.rglob('*.py'))
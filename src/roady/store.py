@@ -0,0 +1,370 @@
+"""
+An optional single-file store for a race's cached resources, instead of
+the many small files in the race and stage dirs.
+
+A sqlite db at race_dpath / STORE_NAME, with one row per file, keyed by
+its path relative to the race dir - so the keys are the same as the
+files, eg '.pcs_race.json', 'stage_4/.cs.html', 'stage_4/img_urls_tags.json'
+
+Code that reads and writes the caches goes through the module functions
+here with the usual fpaths:
+
+>>> store.exists(fpath)
+>>> store.read_text(fpath)
+>>> store.write_text(fpath, text)
+
+which use the race's store if one is open (see open_store()), else the
+file on disk.  Images, the image index and calibration.csv stay on disk.
+
+Writes inside a transaction() are held back and committed together, so
+an interrupted update leaves the store as it was:
+
+>>> with store.transaction(race_dpath):
+...     race.update()
+
+Opening a new store moves in the race's existing cache files.  To look
+at or edit something (eg img_urls_tags.json) write them out, and put
+them back after:
+
+>>> store.export_files(race_dpath, 'stage_4/')
+>>> store.import_files(race_dpath)
+"""
+from contextlib import contextmanager, nullcontext
+from fnmatch import fnmatch
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from .constants import LOG
+
+STORE_NAME = 'race.sqlite'
+
+# the cache files that go in the store, relative to the race dir
+STORE_GLOBS = [
+    '.*.json', '.*.html', '.*.old',
+    'stage_*/.*.json', 'stage_*/.*.html', 'stage_*/.*.old',
+    'stage_*/img_urls_tags.json',
+]
+NOT_STORED = ['.img_index.json']
+
+# open stores, by race dpath
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+class RaceStore:
+
+    def __init__(self, dpath):
+        self.dpath = Path(dpath)
+        self.fpath = self.dpath / STORE_NAME
+
+        # shared by the fetching threads, so one connection behind a lock
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.fpath, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS files '
+                '(key TEXT PRIMARY KEY, content TEXT NOT NULL, '
+                'mtime REAL NOT NULL)')
+
+        # writes waiting for the end of a transaction, key: (content, mtime)
+        # with content None for a delete
+        self._pending = None
+
+    def key(self, fpath):
+        """
+        The key for fpath, or None if it isn't in the race dir
+        """
+        try:
+            return Path(fpath).relative_to(self.dpath).as_posix()
+        except ValueError:
+            return None
+
+    def holds(self, key):
+        """
+        Is the file at key one kept in the store (see STORE_GLOBS)?
+        """
+        return (key.split('/')[-1] not in NOT_STORED
+                and any(fnmatch(key, glob) for glob in STORE_GLOBS))
+
+    def get(self, key):
+        """
+        Return (content, mtime) for the key, or None
+        """
+        with self._lock:
+            if self._pending is not None and key in self._pending:
+                content, mtime = self._pending[key]
+                return None if content is None else (content, mtime)
+
+            return self._conn.execute(
+                'SELECT content, mtime FROM files WHERE key = ?',
+                (key,)).fetchone()
+
+    def put(self, key, content, mtime=None):
+        if mtime is None:
+            mtime = time.time()
+
+        with self._lock:
+            if self._pending is not None:
+                self._pending[key] = (content, mtime)
+                return
+
+            with self._conn:
+                self._write(key, content, mtime)
+
+    def delete(self, key):
+        self.put(key, None)
+
+    def _write(self, key, content, mtime):
+        if content is None:
+            self._conn.execute('DELETE FROM files WHERE key = ?', (key,))
+        else:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                (key, content, mtime))
+
+    def keys(self, prefix=''):
+        with self._lock:
+            keys = {x for x, in self._conn.execute('SELECT key FROM files')
+                    if x.startswith(prefix)}
+
+            for key, (content, _) in (self._pending or {}).items():
+                if not key.startswith(prefix):
+                    continue
+                if content is None:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+
+        return sorted(keys)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold back writes until the end of the block, then commit them in
+        one go.  Nothing is written if the block raises.
+        Reads in the block see the held back writes
+        """
+        with self._lock:
+            outer = self._pending is None
+            if outer:
+                self._pending = {}
+
+        if not outer:
+            yield self
+            return
+
+        try:
+            yield self
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            with self._conn:
+                for key, (content, mtime) in pending.items():
+                    self._write(key, content, mtime)
+
+        LOG.info(f'committed {len(pending)} files to {self.fpath}')
+
+    def import_files(self):
+        """
+        Move the race's cache files on disk into the store
+        """
+        fpaths = [x for glob in STORE_GLOBS for x in self.dpath.glob(glob)
+                  if x.is_file() and x.name not in NOT_STORED]
+
+        with self.transaction():
+            for fpath in fpaths:
+                self.put(self.key(fpath), fpath.read_text(),
+                         fpath.stat().st_mtime)
+
+        # only once committed
+        for fpath in fpaths:
+            fpath.unlink()
+
+        LOG.info(f'imported {len(fpaths)} files to {self.fpath}')
+
+    def export_files(self, prefix=''):
+        """
+        Write the stored files out to the race dir, eg to inspect them.
+        The store still has them, and takes precedence
+        """
+        for key in self.keys(prefix):
+            fpath = self.dpath / key
+            fpath.parent.mkdir(parents=True, exist_ok=True)
+            fpath.write_text(self.get(key)[0])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __repr__(self):
+        return f"RaceStore('{self.fpath}')"
+
+
+def open_store(dpath, create=False):
+    """
+    Open the store for the race dir at dpath, and use it for all reads
+    and writes of the race's cache files from now on.
+    Returns None if there isn't one, unless create=True
+    """
+    dpath = Path(dpath)
+
+    with _STORES_LOCK:
+        if dpath in _STORES:
+            return _STORES[dpath]
+
+        is_new = not (dpath / STORE_NAME).exists()
+        if is_new and not create:
+            return None
+
+        dpath.mkdir(parents=True, exist_ok=True)
+        race_store = RaceStore(dpath)
+        _STORES[dpath] = race_store
+
+    if is_new:
+        race_store.import_files()
+
+    return race_store
+
+
+def export_files(dpath, prefix=''):
+    """
+    Write the race's stored files (those with keys starting with prefix)
+    out to the race dir, see RaceStore.export_files()
+    """
+    race_store = open_store(dpath)
+
+    if race_store is None:
+        print('no store for', dpath)
+        return
+
+    race_store.export_files(prefix)
+
+
+def import_files(dpath):
+    """
+    Move the race's cache files on disk (eg edited after
+    export_files()) into its store
+    """
+    race_store = open_store(dpath)
+
+    if race_store is None:
+        print('no store for', dpath)
+        return
+
+    race_store.import_files()
+
+
+def close_store(dpath):
+    with _STORES_LOCK:
+        race_store = _STORES.pop(Path(dpath), None)
+
+    if race_store is not None:
+        race_store.close()
+
+
+def find_store(fpath):
+    """
+    Return the open store holding fpath, and its key, or (None, None) if
+    it's on disk
+    """
+    for race_store in list(_STORES.values()):
+        key = race_store.key(fpath)
+        if key is not None and race_store.holds(key):
+            return race_store, key
+
+    return None, None
+
+
+def transaction(dpath):
+    """
+    A transaction on the race's store, or a do nothing context if the
+    race doesn't have one open
+    """
+    race_store = _STORES.get(Path(dpath))
+
+    if race_store is None:
+        return nullcontext()
+
+    return race_store.transaction()
+
+
+# the file functions
+def exists(fpath):
+    race_store, key = find_store(fpath)
+
+    if race_store is None:
+        return fpath.exists()
+
+    return race_store.get(key) is not None
+
+
+def read_text(fpath):
+    race_store, key = find_store(fpath)
+
+    if race_store is None:
+        return fpath.read_text()
+
+    row = race_store.get(key)
+
+    if row is None:
+        raise FileNotFoundError(fpath)
+
+    return row[0]
+
+
+def write_text(fpath, text):
+    race_store, key = find_store(fpath)
+
+    if race_store is None:
+        fpath.write_text(text)
+    else:
+        race_store.put(key, text)
+
+
+def mtime(fpath):
+    race_store, key = find_store(fpath)
+
+    if race_store is None:
+        return fpath.stat().st_mtime
+
+    row = race_store.get(key)
+
+    if row is None:
+        raise FileNotFoundError(fpath)
+
+    return row[1]
+
+
+def delete(fpath):
+    race_store, key = find_store(fpath)
+
+    if race_store is None:
+        fpath.unlink()
+    else:
+        race_store.delete(key)
+
+
+def list_files(dpath):
+    """
+    The files directly in dpath, from the store as well as on disk
+    """
+    dpath = Path(dpath)
+    out = {x for x in dpath.iterdir() if x.is_file()} if dpath.exists() else set()
+
+    for race_store in list(_STORES.values()):
+        key = race_store.key(dpath)
+        if key is None:
+            continue
+
+        prefix = '' if key == '.' else f"{key}/"
+        out |= {race_store.dpath / x for x in race_store.keys(prefix)
+                if '/' not in x[len(prefix):]}
+
+    return sorted(out)
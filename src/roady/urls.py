@@ -1,5 +1,4 @@
 import re
-import procyclingstats
 """
 CS urls have a weirdness where they put 'route' at different places,
 depending on if its a grand tour or not.  The main function here takes
@@ -182,6 +181,7 @@ def get_pcs_race_names(rider_name='tadej-pogacar'):
     A handy way to return a big chunk of pcs race names by parsing
     rider results
     """
+    import procyclingstats
 
     res = procyclingstats.RiderResults(
         f"rider/{rider_name}/results").parse()['results']